@@ -20,7 +20,8 @@ setup(name='django-sitemap-extras',
       author='Justin Quick',
       author_email='justquick@gmail.com',
       url='http://github.com/justquick/django-sitemap-extras',
-      packages=['sitemapext', 'sitemapext.runtests', 'sitemapext.builder'],
+      packages=['sitemapext', 'sitemapext.runtests', 'sitemapext.builder',
+                'sitemapext.management', 'sitemapext.management.commands'],
       install_requires=read_file('requirements.txt'),
       zip_safe=False,
       classifiers=['Development Status :: 3 - Alpha',
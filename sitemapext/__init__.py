@@ -1,8 +1,25 @@
-try:
-    from .views import (SitemapGenerator, SitemapIndex, SitemapView, VideoSitemapView, ImageSitemapView,
-                        NewsSitemapView, MobileSitemapView, GoogleBotVerifierMixin)
-except ImportError:
-    pass
+import sys
+from types import ModuleType
+
+# Public names and the submodules they are imported from on first access,
+# so importing the package does not load Django, lxml or the builders
+LAZY_ATTRS = {
+    'SitemapGenerator': 'views',
+    'SitemapIndex': 'views',
+    'SitemapView': 'views',
+    'VideoSitemapView': 'views',
+    'ImageSitemapView': 'views',
+    'NewsSitemapView': 'views',
+    'MobileSitemapView': 'views',
+    'GoogleBotVerifierMixin': 'views',
+    'SitemapRegistry': 'registry',
+    'SitemapEntry': 'entries',
+    'ImageEntry': 'entries',
+    'NewsEntry': 'entries',
+    'VideoEntry': 'entries',
+}
+
+default_app_config = 'sitemapext.apps.SitemapExtConfig'
 
 __version_info__ = {
     'major': 0,
@@ -24,3 +41,26 @@ def get_version(release_level=True):
 
 
 __version__ = get_version()
+
+
+class LazyModule(ModuleType):
+    """
+    Imports the public names of the package from their submodules when they are first accessed
+    """
+
+    def __getattr__(self, name):
+        if name not in LAZY_ATTRS:
+            raise AttributeError('module %r has no attribute %r' % (self.__name__, name))
+        value = getattr(__import__('%s.%s' % (self.__name__, LAZY_ATTRS[name]), fromlist=[name]), name)
+        setattr(self, name, value)
+        return value
+
+    def __dir__(self):
+        return sorted(set(self.__dict__) | set(LAZY_ATTRS))
+
+
+_lazy_module = LazyModule(__name__, __doc__)
+_lazy_module.__dict__.update(sys.modules[__name__].__dict__)
+# Keep the original module alive, its globals are still used by the functions defined above
+_lazy_module._original_module = sys.modules[__name__]
+sys.modules[__name__] = _lazy_module
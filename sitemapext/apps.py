@@ -0,0 +1,64 @@
+from django.http import HttpRequest
+from django.core.signals import request_started
+try:
+    from django.apps import AppConfig
+except ImportError:
+    # Django < 1.7 has no app configs, call warmup() from your WSGI script instead
+    AppConfig = object
+
+from .settings import CONFIG
+from .utils import import_string, logger
+
+
+def warmup(sitemaps=None):
+    """
+    Imports the views and builders and renders an empty page with the builder of every sitemap view,
+    which resolves the settings, namespaces and site domain, so the first request after a deploy does not pay for them.
+    Warms up the views of the sitemaps dictionary, which defaults to the one at SITEMAPS_CONFIG['SITEMAPS'],
+    or all the bundled views, and builds its registry. Returns the view classes that were warmed up.
+    """
+    from . import views
+    from .registry import get_registry
+
+    if sitemaps is None and CONFIG()['SITEMAPS']:
+        sitemaps = import_string(CONFIG()['SITEMAPS'])
+    if sitemaps is None:
+        view_classes = [views.SitemapView, views.NewsSitemapView, views.VideoSitemapView, views.ImageSitemapView,
+                        views.MobileSitemapView, views.SitemapIndex]
+    else:
+        view_classes = list(sitemaps.values()) + [views.SitemapIndex]
+        try:
+            get_registry(sitemaps)
+        except Exception:
+            logger.debug('Could not build the sitemaps registry', exc_info=True)
+    request = HttpRequest()
+    request.META.update({'SERVER_NAME': 'localhost', 'SERVER_PORT': '80'})
+    warmed = []
+    for view_class in view_classes:
+        try:
+            view = view_class(request=request, args=(), kwargs={})
+            b''.join(view.builder_class(view, ()).iter_render())
+        except Exception:
+            logger.debug('Could not warm up %s', view_class.__name__, exc_info=True)
+        else:
+            warmed.append(view_class)
+    return warmed
+
+
+def warmup_on_request(sender, **kwargs):
+    """
+    Warms up the sitemaps on the first request, then stops listening
+    """
+    request_started.disconnect(warmup_on_request, dispatch_uid='sitemapext.warmup')
+    warmup()
+
+
+class SitemapExtConfig(AppConfig):
+    name = 'sitemapext'
+    verbose_name = 'Sitemap Extras'
+
+    def ready(self):
+        # Rendering looks up the site domain, and apps must not query the database while Django loads them,
+        # so only the imports are done here and the rest is left to the first request
+        from . import views
+        request_started.connect(warmup_on_request, dispatch_uid='sitemapext.warmup')
@@ -1,14 +1,51 @@
 from math import floor
-from datetime import date, datetime
+from hashlib import md5
+from itertools import islice
+from collections import deque
+from datetime import date, datetime, time
 from lxml import etree
 
 try:
     from django.utils import timezone
 except ImportError:
     timezone = None
+try:
+    from django.db.models import prefetch_related_objects
+except ImportError:
+    try:
+        from django.db.models.query import prefetch_related_objects as _prefetch_related_objects
+
+        def prefetch_related_objects(instances, *lookups):
+            _prefetch_related_objects(instances, lookups)
+    except ImportError:
+        # Django < 1.4 has no prefetch_related
+        prefetch_related_objects = None
 
 from ..settings import FREQS, CONFIG
-from ..utils import assert_, force_text, get_current_domain, INT_TYPES
+from ..entries import SitemapEntry
+from ..utils import (assert_, validating, force_text, get_current_domain, logger, ValidationReport, INT_TYPES,
+                     HOST_PLACEHOLDER)
+from .. import metrics
+
+
+def iter_batches(objects, size):
+    """
+    Yields the objects in batches of size objects, streaming querysets from the database without caching them.
+    Querysets stream without their prefetch_related lookups, which are prefetched for each batch instead.
+    """
+    lookups = getattr(objects, '_prefetch_related_lookups', None)
+    if hasattr(objects, 'iterator'):
+        if lookups:
+            objects = objects.prefetch_related(None)
+        objects = objects.iterator()
+    objects = iter(objects)
+    while True:
+        batch = list(islice(objects, size))
+        if not batch:
+            return
+        if lookups:
+            prefetch_related_objects(batch, *lookups)
+        yield batch
 
 
 class Formatter(object):
@@ -45,7 +82,8 @@ class Formatter(object):
     def priority(value):
         if isinstance(value, INT_TYPES):
             value = floor(value * 10) / 10
-        assert_(1. >= value >= 0., 'Priority %r invalid, must be between 0 and 1', value)
+        if validating():
+            assert_(1. >= value >= 0., 'Priority %r invalid, must be between 0 and 1', value)
         return str(value)
 
     @classmethod
@@ -57,13 +95,15 @@ class Formatter(object):
 
     @staticmethod
     def changefreq(value):
-        assert_(value in FREQS, 'Change frequency "%s" invalid, must be one of %s', value, ','.join(FREQS))
+        if validating():
+            assert_(value in FREQS, 'Change frequency "%s" invalid, must be one of %s', value, ','.join(FREQS))
         return value
 
 
 class Abstract(object):
     root_element = 'urlset'
     formatter_class = Formatter
+    # Every namespace used by a builder is declared here, once, on the root element
     nsmap = {
         None: 'http://www.sitemaps.org/schemas/sitemap/0.9'
     }
@@ -73,12 +113,38 @@ class Abstract(object):
         self.object_list = object_list
         self.domain = get_current_domain(view.request)
         self.protocol = 'https' if view.request.is_secure() else 'http'
+        self.prefix = '%s://%s' % (self.protocol, self.domain)
+        if CONFIG()['HOST_AGNOSTIC']:
+            self.prefix = HOST_PLACEHOLDER
         self.formatter = self.formatter_class(self)
+        self.count = 0
+        self.lastmod = None
+        get_fragment_cache = getattr(view, 'get_fragment_cache', None)
+        self.fragments = get_fragment_cache and get_fragment_cache()
+        self.dedup = getattr(view, 'dedup', None)
+        self.pending = deque()
+        self.lastmods = {}
+        self.digest = None
 
     def full_url(self, absolute_url):
-        return '%s://%s%s' % (self.protocol, self.domain, absolute_url)
+        return '%s%s' % (self.prefix, absolute_url)
+
+    def update_lastmod(self, value):
+        """
+        Keeps track of the most recent lastmod of all the URLs rendered, ignoring values that are not dates
+        """
+        if not isinstance(value, date):
+            return
+        if not isinstance(value, datetime):
+            value = datetime.combine(value, time())
+        if self.lastmod is None or value > self.lastmod:
+            self.lastmod = value
 
     def _get(self, name, obj, default=None):
+        if name == 'lastmod' and id(obj) in self.lastmods:
+            return self.lastmods[id(obj)]
+        if isinstance(obj, SitemapEntry) and name in obj.fields:
+            return getattr(obj, name)
         try:
             attr = getattr(self.view, name)
         except AttributeError:
@@ -90,14 +156,182 @@ class Abstract(object):
     def ns_format(self, tag, ns=None):
         return '{%s}%s' % (self.nsmap[ns], tag)
 
-    def render(self):
-        conf = CONFIG()
+    def serialize(self, pretty):
+        """
+        Returns the serialized markup of the elements attached to the root,
+        without the root start and end tags.
+        """
+        content = etree.tostring(self.root, pretty_print=pretty, encoding='UTF-8')
+        return content[content.index(b'>') + 1:content.rindex(b'</')].lstrip(b'\n')
+
+    def detach(self):
+        """
+        Clears and detaches all the elements attached to the root so they can be freed
+        """
+        for elem in self.root:
+            elem.clear()
+        del self.root[:]
+
+    def unique(self, batch):
+        """
+        Returns the objects of a batch whose URL is not in the view's dedup filter nor earlier in the page,
+        counting the others as dropped. The URLs kept are only added to the filter by emit, once their elements
+        are part of the page, so URLs left out at MAX_SIZE can still be listed by another page.
+        """
+        objects = []
+        urls = set(self.pending)
+        for obj in batch:
+            url = self.full_url(self._get('location', obj))
+            if url in urls or url in self.dedup:
+                self.dedup.drop()
+                continue
+            urls.add(url)
+            self.pending.append(url)
+            objects.append(obj)
+        return objects
+
+    def fragment_key(self, obj):
+        """
+        Returns the fragment cache key of an object or None if it should not be cached.
+        Views may define a fragment_key(obj) method, otherwise the key is made from the object's pk and lastmod,
+        formatted like the rendered lastmod. The lastmod is kept for the render of the object's batch.
+        """
+        lastmod = self.lastmods[id(obj)] = self._get('lastmod', obj)
+        if lastmod is not None:
+            self.update_lastmod(lastmod)
+        if hasattr(self.view, 'fragment_key'):
+            return self.view.fragment_key(obj)
+        if getattr(obj, 'pk', None) is None or lastmod is None:
+            return None
+        formatted = self.formatter.lastmod(lastmod)
+        return '%s:%s' % (obj.pk, force_text(lastmod) if formatted is None else formatted)
+
+    def prepare_batch(self, batch):
+        """
+        Called with each batch of objects before they are rendered, eg to look up related data for all of them at once
+        """
+
+    def iter_batches(self):
+        """
+        Yields the object list in batches of CHUNK_SIZE objects, see iter_batches
+        """
+        return iter_batches(self.object_list, CONFIG()['CHUNK_SIZE'])
+
+    def render_chunks(self, pretty):
+        """
+        Renders the object list in batches of CHUNK_SIZE objects and yields the number of URLs and markup of each chunk.
+        The elements of a chunk stay attached to the root until the next chunk is requested.
+        With a fragment cache, every URL is its own chunk and only objects missing from the cache are rendered.
+        Fragments are cached per view class, so sections sharing a builder never serve each other's markup.
+        With a dedup filter, objects whose URL was already rendered are dropped.
+        """
+        for batch in self.iter_batches():
+            if self.dedup is not None:
+                batch = self.unique(batch)
+                if not batch:
+                    continue
+            self.prepare_batch(batch)
+            if self.fragments is None:
+                for obj in batch:
+                    self.render_obj(obj)
+                yield len(batch), self.serialize(pretty)
+                self.detach()
+                continue
+            keys = []
+            for obj in batch:
+                key = self.fragment_key(obj)
+                if key is not None:
+                    key = '%s:%s.%s:%s:%s:%s' % (self.__class__.__name__, self.view.__class__.__module__,
+                                                 self.view.__class__.__name__, self.prefix, pretty, key)
+                    key = 'sitemapext.fragment.%s' % md5(key.encode('utf-8')).hexdigest()
+                keys.append(key)
+            cached = self.fragments.get_many([key for key in keys if key])
+            rendered = {}
+            for obj, key in zip(batch, keys):
+                markup = cached.get(key)
+                if markup is None:
+                    self.render_obj(obj)
+                    markup = self.serialize(pretty)
+                    if key:
+                        rendered[key] = markup
+                yield 1, markup
+                self.detach()
+            self.lastmods = {}
+            self.fragments.set_many(rendered)
+
+    def start(self, pretty):
+        """
+        Creates the root element and returns the serialized markup before and after its children
+        """
         self.root = etree.Element(self.ns_format(self.root_element), nsmap=self.nsmap)
-        count = 0
-        for obj in self.object_list:
-            count += len(etree.tostring(self.render_obj(obj), encoding='UTF-8'))
-            if count > conf['MAX_SIZE']:
-                assert_(False, 'Maximum size of %s exceeded', conf['MAX_SIZE'])
-                break
-        return etree.tostring(self.root, pretty_print=conf['PRETTY'],
-                              xml_declaration=True, encoding='UTF-8')
+        self.root.append(etree.Comment('chunk'))
+        head, tail = etree.tostring(self.root, pretty_print=pretty, xml_declaration=True,
+                                    encoding='UTF-8').split(b'<!--chunk-->')
+        del self.root[:]
+        return head.rstrip(b' '), tail.lstrip(b'\n')
+
+    def emit(self, count, chunk):
+        """
+        Accounts for count elements of the page serialized as chunk, updating the fingerprint of the page when
+        digest is set and adding their URLs to the view's dedup filter
+        """
+        self.count += count
+        if self.digest is not None:
+            self.digest.update(chunk)
+        if self.dedup is not None:
+            for i in range(count):
+                self.dedup.add(self.pending.popleft())
+
+    def iter_render(self):
+        """
+        Yields the serialized sitemap piece by piece.
+        Only one chunk of elements is kept in memory at a time, whatever the size of the object list.
+        With a digest, the fingerprint of the page is the hash of the markup of every element it contains.
+        """
+        conf = CONFIG()
+        pretty = conf['PRETTY']
+        head, tail = self.start(pretty)
+        yield head
+        size = 0
+        for count, chunk in self.render_chunks(pretty):
+            if size + len(chunk) <= conf['MAX_SIZE']:
+                size += len(chunk)
+                self.emit(count, chunk)
+                yield chunk
+                continue
+            # The chunk overflowed, so fit in as many of its elements as possible
+            assert_(False, 'Maximum size of %s exceeded', conf['MAX_SIZE'])
+            elems = list(self.root) if count > 1 else []
+            del self.root[:]
+            for elem in elems:
+                self.root.append(elem)
+                chunk = self.serialize(pretty)
+                self.detach()
+                size += len(chunk)
+                if size > conf['MAX_SIZE']:
+                    break
+                self.emit(1, chunk)
+                yield chunk
+            break
+        self.detach()
+        yield tail
+
+    def render(self):
+        """
+        Returns the whole sitemap, reporting any invalid values found as set by VALIDATION.
+        Renders are counted in the pages_rendered metric and invalid values in the validation_errors metric.
+        """
+        metrics.incr('pages_rendered')
+        with ValidationReport() as report:
+            content = b''.join(self.iter_render())
+        self.report(report)
+        return content
+
+    def report(self, report):
+        """
+        Counts the invalid values found while rendering, logging a summary of them unless each was logged already
+        """
+        if report.total:
+            metrics.incr('validation_errors', report.total)
+            if report.mode != 'log':
+                logger.warning('%s: %s', self.view.request.path, report.summary())
@@ -7,8 +7,15 @@ class Index(Abstract):
     root_element = 'sitemapindex'
 
     def render_obj(self, obj):
+        lastmod = None
+        if isinstance(obj, (list, tuple)):
+            obj, lastmod = obj
         assert_(len(obj) < 2048, 'Sitemap URL "%s" invalid, must be shorter than 2048 characters', obj)
         elem = etree.SubElement(self.root, 'sitemap')
         loc = etree.SubElement(elem, 'loc')
         loc.text = self.full_url(obj)
+        if lastmod is not None:
+            self.update_lastmod(lastmod)
+            subelem = etree.SubElement(elem, 'lastmod')
+            subelem.text = self.formatter.lastmod(lastmod)
         return elem
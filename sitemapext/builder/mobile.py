@@ -11,6 +11,6 @@ class MobileSitemap(Sitemap):
 
     def render_obj(self, obj):
         elem = super(MobileSitemap, self).render_obj(obj)
-        etree.SubElement(elem, self.ns_format('mobile', 'mobile'), nsmap=self.nsmap)
+        etree.SubElement(elem, self.ns_format('mobile', 'mobile'))
         return elem
 
@@ -2,7 +2,7 @@ from types import GeneratorType
 
 from lxml import etree
 
-from .base import Formatter, assert_
+from .base import Formatter, assert_, validating
 from .simple import Sitemap
 from ..settings import ACCESSES, GENRES, NEWS_ATTRS
 
@@ -11,7 +11,8 @@ class NewsFormatter(Formatter):
 
     @staticmethod
     def access(value):
-        assert_(value.lower() in ACCESSES, 'Access level %s invalid, must be one of %s', value, ','.join(ACCESSES))
+        if validating():
+            assert_(value.lower() in ACCESSES, 'Access level %s invalid, must be one of %s', value, ','.join(ACCESSES))
         return value.title()
 
     @classmethod
@@ -20,8 +21,9 @@ class NewsFormatter(Formatter):
 
     @classmethod
     def genres(cls, value):
-        for val in value:
-            assert_(val in GENRES, 'Genre %s invalid, must be one of %s', val, ','.join(GENRES))
+        if validating():
+            for val in value:
+                assert_(val in GENRES, 'Genre %s invalid, must be one of %s', val, ','.join(GENRES))
         return cls.format_comma_sep(value)
 
     @classmethod
@@ -48,7 +50,7 @@ class NewsSitemap(Sitemap):
 
     def render_obj(self, obj):
         elem = super(NewsSitemap, self).render_obj(obj)
-        newselem = etree.SubElement(elem, self.ns_format('news', 'news'), nsmap=self.nsmap)
+        newselem = etree.SubElement(elem, self.ns_format('news', 'news'))
         for attr in NEWS_ATTRS:
             value = self._get(attr, obj)
             if value is None:
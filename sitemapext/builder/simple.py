@@ -1,14 +1,52 @@
+
 from lxml import etree
 
 from ..settings import OPTIONAL_ATTRS
-from .base import Abstract, assert_
+from ..utils import OrderedDict
+from .base import Abstract, assert_, validating
+
+XHTML_NS = 'http://www.w3.org/1999/xhtml'
 
 
 class Sitemap(Abstract):
+    """
+    Renders hreflang alternate links for views that define get_alternates(objects), which returns a dictionary
+    of the alternates of a whole batch of objects keyed by object pk, or alternates(obj) for a single object.
+    Alternates are a dictionary or list of (hreflang, location) pairs.
+    Relative locations are made absolute like the object's own, locations on other domains are kept as they are.
+    The xhtml namespace is only declared for views with alternates.
+    """
+
+    def __init__(self, view, object_list):
+        super(Sitemap, self).__init__(view, object_list)
+        self.batch_alternates = hasattr(view, 'get_alternates')
+        self.alternates = {}
+        if self.batch_alternates or hasattr(view, 'alternates'):
+            self.nsmap = dict(self.nsmap, xhtml=XHTML_NS)
+
+    def prepare_batch(self, batch):
+        if self.batch_alternates:
+            self.alternates = self.view.get_alternates(batch)
+
+    def render_alternates(self, elem, obj):
+        if self.batch_alternates:
+            alternates = self.alternates.get(getattr(obj, 'pk', None))
+        else:
+            alternates = self._get('alternates', obj)
+        if not alternates:
+            return
+        if hasattr(alternates, 'items'):
+            alternates = sorted(alternates.items())
+        for hreflang, location in alternates:
+            if location.startswith('/'):
+                location = self.full_url(location)
+            etree.SubElement(elem, '{%s}link' % XHTML_NS, OrderedDict([
+                ('rel', 'alternate'), ('hreflang', hreflang), ('href', location)]))
 
     def render_obj(self, obj):
         location = self.full_url(self._get('location', obj))
-        assert_(len(location) < 2048, 'URL "%s" invalid, must be shorter than 2048 characters', location)
+        if validating():
+            assert_(len(location) < 2048, 'URL "%s" invalid, must be shorter than 2048 characters', location)
         elem = etree.SubElement(self.root, 'url')
         loc = etree.SubElement(elem, 'loc')
         loc.text = location
@@ -16,9 +54,13 @@ class Sitemap(Abstract):
             value = self._get(attr, obj)
             if value is None:
                 continue
+            if attr == 'lastmod':
+                self.update_lastmod(value)
             if hasattr(self.formatter, attr):
                 value = getattr(self.formatter, attr)(value)
             subelem = etree.SubElement(elem, attr)
             subelem.text = value
+        if 'xhtml' in self.nsmap:
+            self.render_alternates(elem, obj)
         return elem
 
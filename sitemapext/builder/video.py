@@ -4,7 +4,7 @@ from lxml import etree
 
 from ..settings import VIDEO_ATTRS
 from ..utils import INT_TYPES
-from .base import Formatter, assert_
+from .base import Formatter, assert_, validating
 from .simple import Sitemap
 
 
@@ -39,14 +39,16 @@ class VideoFormatter(Formatter):
     @staticmethod
     def duration(value):
         value = int(value)
-        assert_(28800 > value > 0, 'Duration %s invalid, must be less than 8hrs (28800 seconds)', value)
+        if validating():
+            assert_(28800 > value > 0, 'Duration %s invalid, must be less than 8hrs (28800 seconds)', value)
         return str(value)
 
     @staticmethod
     def rating(value):
         if isinstance(value, INT_TYPES):
             value = floor(value * 10) / 10
-        assert_(5. >= value >= 0., 'Rating %s invalid, must be between 0 and 5', value)
+        if validating():
+            assert_(5. >= value >= 0., 'Rating %s invalid, must be between 0 and 5', value)
         return str(value)
 
     @staticmethod
@@ -72,6 +74,7 @@ class VideoFormatter(Formatter):
 
     def prices(self, value):
         for attrs in value:
+            attrs = dict(attrs)
             amount = attrs.pop('value')
             tagelem = etree.Element(self.builder.ns_format('price', 'video'), **attrs)
             tagelem.text = str(amount)
@@ -98,7 +101,7 @@ class VideoSitemap(Sitemap):
 
     def render_obj(self, obj):
         elem = super(VideoSitemap, self).render_obj(obj)
-        videoelem = etree.SubElement(elem, self.ns_format('video', 'video'), nsmap=self.nsmap)
+        videoelem = etree.SubElement(elem, self.ns_format('video', 'video'))
         for attr in VIDEO_ATTRS:
             value = self._get(attr, obj)
             if value is None:
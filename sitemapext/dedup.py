@@ -0,0 +1,82 @@
+from math import ceil, log
+from hashlib import md5
+from struct import unpack
+from threading import Lock
+
+from .utils import force_text
+
+
+class ExactFilter(object):
+    """
+    Remembers the digest of every URL added, so duplicates are always detected.
+    Uses roughly 100 bytes per URL.
+    """
+
+    def __init__(self):
+        self.seen = set()
+        self.dropped = 0
+        self.lock = Lock()
+
+    def __contains__(self, url):
+        return md5(force_text(url).encode('utf-8')).digest() in self.seen
+
+    def add(self, url):
+        """
+        Adds the URL and returns False if it was added before
+        """
+        digest = md5(force_text(url).encode('utf-8')).digest()
+        with self.lock:
+            if digest in self.seen:
+                return False
+            self.seen.add(digest)
+        return True
+
+    def drop(self):
+        """
+        Counts a duplicate URL left out of a page
+        """
+        with self.lock:
+            self.dropped += 1
+
+
+class BloomFilter(object):
+    """
+    A fixed size probabilistic filter sized for capacity URLs with the given false positive rate.
+    A false positive drops a URL that was not a duplicate, so keep error_rate low.
+    At the default rate of one in a million it uses about 3.6 bytes per URL, or 36MB for ten million URLs.
+    """
+
+    def __init__(self, capacity, error_rate=1e-6):
+        self.size = int(ceil(-capacity * log(error_rate) / log(2) ** 2))
+        self.hashes = max(int(round(self.size / float(capacity) * log(2))), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+        self.dropped = 0
+        self.lock = Lock()
+
+    def positions(self, url):
+        first, second = unpack('<QQ', md5(force_text(url).encode('utf-8')).digest())
+        for i in range(self.hashes):
+            position = (first + i * second) % self.size
+            yield position >> 3, 1 << (position & 7)
+
+    def __contains__(self, url):
+        return all([self.bits[byte] & bit for byte, bit in self.positions(url)])
+
+    def add(self, url):
+        """
+        Adds the URL and returns False if it was (probably) added before
+        """
+        found = True
+        with self.lock:
+            for byte, bit in self.positions(url):
+                if not self.bits[byte] & bit:
+                    found = False
+                    self.bits[byte] |= bit
+        return not found
+
+    def drop(self):
+        """
+        Counts a duplicate URL left out of a page
+        """
+        with self.lock:
+            self.dropped += 1
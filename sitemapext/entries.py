@@ -0,0 +1,37 @@
+from .settings import OPTIONAL_ATTRS, NEWS_ATTRS, VIDEO_ATTRS
+
+
+class SitemapEntry(object):
+    """
+    A lightweight record of everything rendered for a single URL.
+    Views can yield entries instead of model instances, eg built from values_list rows,
+    and the builders read the entry's fields directly instead of calling the view's accessors.
+    Fields left out default to None and are not rendered.
+    """
+    fields = ('location', 'pk') + OPTIONAL_ATTRS
+    __slots__ = fields
+
+    def __init__(self, location, **kwargs):
+        self.location = location
+        for name in self.fields[1:]:
+            setattr(self, name, kwargs.pop(name, None))
+        if kwargs:
+            raise TypeError('%s got unexpected fields: %s' % (self.__class__.__name__, ', '.join(kwargs)))
+
+    def __repr__(self):
+        return '<%s: %s>' % (self.__class__.__name__, self.location)
+
+
+class ImageEntry(SitemapEntry):
+    __slots__ = ('images',)
+    fields = SitemapEntry.fields + __slots__
+
+
+class NewsEntry(SitemapEntry):
+    __slots__ = tuple([attr for attr in NEWS_ATTRS if not attr in SitemapEntry.fields])
+    fields = SitemapEntry.fields + __slots__
+
+
+class VideoEntry(SitemapEntry):
+    __slots__ = tuple([attr for attr in VIDEO_ATTRS if not attr in SitemapEntry.fields])
+    fields = SitemapEntry.fields + __slots__
@@ -0,0 +1,80 @@
+from threading import Lock
+
+from .settings import CONFIG
+from .utils import get_cache, OrderedDict
+
+
+class LRUCache(object):
+    """
+    A thread safe in-process cache that holds at most size items, discarding the least recently used
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.data = OrderedDict()
+        self.lock = Lock()
+
+    def get_many(self, keys):
+        found = {}
+        with self.lock:
+            for key in keys:
+                if key in self.data:
+                    found[key] = self.data[key] = self.data.pop(key)
+        return found
+
+    def set_many(self, data):
+        with self.lock:
+            for key, value in data.items():
+                self.data.pop(key, None)
+                self.data[key] = value
+            while len(self.data) > self.size:
+                del self.data[next(iter(self.data))]
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+
+class FragmentCache(object):
+    """
+    Caches the rendered markup of single URL elements in a bounded in-process LRU cache,
+    backed by a shared Django cache so fragments survive restarts and are shared between workers.
+    """
+
+    def __init__(self, size=None, cache=None, timeout=None):
+        conf = CONFIG()
+        self.local = LRUCache(size or conf['FRAGMENT_CACHE_SIZE'])
+        alias = cache or conf['FRAGMENT_CACHE']
+        self.shared = alias and get_cache(alias)
+        self.timeout = timeout or conf['FRAGMENT_CACHE_TIMEOUT']
+
+    def get_many(self, keys):
+        found = self.local.get_many(keys)
+        if self.shared:
+            missing = [key for key in keys if key not in found]
+            if missing:
+                shared = self.shared.get_many(missing)
+                self.local.set_many(shared)
+                found.update(shared)
+        return found
+
+    def set_many(self, data):
+        self.local.set_many(data)
+        if self.shared:
+            self.shared.set_many(data, self.timeout)
+
+    def clear(self):
+        self.local.clear()
+
+
+_fragment_cache = None
+
+
+def get_fragment_cache():
+    """
+    Returns the fragment cache shared by all sitemap views in this process
+    """
+    global _fragment_cache
+    if _fragment_cache is None:
+        _fragment_cache = FragmentCache()
+    return _fragment_cache
@@ -0,0 +1,104 @@
+from time import time, sleep
+from uuid import uuid4
+from threading import Lock
+
+from .settings import CONFIG
+from .utils import get_cache
+from . import metrics
+
+
+class Saturated(Exception):
+    """
+    Raised when no render slot became free within the queue timeout
+    """
+
+
+class RenderLimiter(object):
+    """
+    Limits the number of sitemaps rendered at the same time.
+    max_renders bounds the renders in this process and max_shared_renders bounds them across all
+    processes, using cache.add on a fixed set of slot keys as a lock. Each slot holds a token unique to
+    the render that took it, so a render whose slot expired never frees the slot of another.
+    Requests wait up to timeout seconds for a slot before Saturated is raised.
+    """
+    poll_interval = .05
+
+    def __init__(self, max_renders=None, max_shared_renders=None, timeout=0, cache='default', lock_timeout=300):
+        self.max_renders = max_renders
+        self.max_shared_renders = max_shared_renders
+        self.timeout = timeout
+        self.cache = cache
+        self.lock_timeout = lock_timeout
+        self.active = 0
+        self.lock = Lock()
+
+    def acquire_local(self):
+        if self.max_renders is None:
+            return True
+        with self.lock:
+            if self.active < self.max_renders:
+                self.active += 1
+                return True
+        return False
+
+    def release_local(self):
+        if self.max_renders is not None:
+            with self.lock:
+                self.active -= 1
+
+    def acquire_shared(self):
+        if self.max_shared_renders is None:
+            return True
+        cache = get_cache(self.cache)
+        token = uuid4().hex
+        for slot in range(self.max_shared_renders):
+            key = 'sitemapext.render.slot.%s' % slot
+            if cache.add(key, token, self.lock_timeout):
+                return key, token
+        return None
+
+    def acquire(self):
+        """
+        Waits for a free slot and returns a token to release it with
+        """
+        start = time()
+        while True:
+            if self.acquire_local():
+                token = self.acquire_shared()
+                if token:
+                    metrics.incr('renders')
+                    metrics.incr('render_wait_ms', int((time() - start) * 1000))
+                    return token
+                self.release_local()
+            if time() - start >= self.timeout:
+                metrics.incr('renders_shed')
+                raise Saturated
+            sleep(self.poll_interval)
+
+    def release(self, token):
+        if token is not True:
+            key, token = token
+            cache = get_cache(self.cache)
+            if cache.get(key) == token:
+                cache.delete(key)
+        self.release_local()
+
+
+_limiters = {}
+_limiters_lock = Lock()
+
+
+def get_limiter():
+    """
+    Returns the render limiter for the current SITEMAPS_CONFIG, shared by all views in this process,
+    or None if renders are not limited
+    """
+    conf = CONFIG()
+    if conf['MAX_RENDERS'] is None and conf['MAX_SHARED_RENDERS'] is None:
+        return None
+    args = (conf['MAX_RENDERS'], conf['MAX_SHARED_RENDERS'], conf['RENDER_QUEUE_TIMEOUT'],
+            conf['RENDER_LOCK_CACHE'], conf['RENDER_LOCK_TIMEOUT'])
+    with _limiters_lock:
+        if args not in _limiters:
+            _limiters[args] = RenderLimiter(*args)
+        return _limiters[args]
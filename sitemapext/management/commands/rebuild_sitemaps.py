@@ -0,0 +1,45 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from sitemapext.tasks import Rebuilder, Scheduler
+
+
+class Command(BaseCommand):
+    args = '<sitemaps>'
+    help = ('Renders and stores every page of the sitemaps dictionary at the given dotted path. '
+            'With --schedule, keeps rebuilding each section every rebuild_interval seconds. '
+            'With --purge, deletes the stored pages the rebuild no longer produces for the host.')
+    option_list = BaseCommand.option_list + (
+        make_option('--generator', default='sitemap-generator',
+                    help='URL name of the SitemapGenerator view'),
+        make_option('--index', default=None,
+                    help='URL name of the SitemapIndex view'),
+        make_option('--host', default='localhost',
+                    help='Host name to render the sitemaps for'),
+        make_option('--secure', action='store_true', default=False,
+                    help='Render https URLs'),
+        make_option('--database', default=None,
+                    help='Alias of the database to run the sitemap queries on'),
+        make_option('--dedup', choices=['exact', 'bloom'], default=None,
+                    help='Drop URLs already listed by another section, using an exact set or a Bloom filter'),
+        make_option('--schedule', action='store_true', default=False,
+                    help='Keep rebuilding sections on their rebuild_interval'),
+        make_option('--purge', action='store_true', default=False,
+                    help='Delete stored pages past the end of a section and pages stored without a host'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError('Provide the dotted path to a sitemaps dictionary')
+        rebuilder = Rebuilder(args[0], options['generator'], options['index'],
+                              host=options['host'], secure=options['secure'], using=options['database'],
+                              dedup=options['dedup'])
+        if options['schedule']:
+            if options['purge']:
+                rebuilder.purge()
+            Scheduler(rebuilder).run_forever()
+        else:
+            rebuilder.rebuild_all()
+            if options['purge']:
+                self.stdout.write('Deleted %s stale sitemap pages' % rebuilder.purge())
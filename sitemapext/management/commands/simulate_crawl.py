@@ -0,0 +1,42 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from sitemapext.simulation import CrawlSimulation, format_report
+from sitemapext.utils import get_cache
+from sitemapext.fragments import get_fragment_cache
+
+
+class Command(BaseCommand):
+    args = '<index url>'
+    help = ('Simulates a burst of crawlers fetching the sitemap index at the given path and every page it lists, '
+            'first with cold caches and then with warm ones, and reports latencies, queries and cache hits.')
+    option_list = BaseCommand.option_list + (
+        make_option('--clients', type='int', default=10,
+                    help='Number of crawlers fetching every page at the same time'),
+        make_option('--rounds', type='int', default=1,
+                    help='Number of warm crawls after the cold one'),
+        make_option('--host', default='localhost',
+                    help='Host name to request the sitemaps for'),
+        make_option('--secure', action='store_true', default=False,
+                    help='Make https requests'),
+        make_option('--clear-cache', action='store_true', default=False,
+                    help='Clear the cache given by --cache before the cold crawl, with everything else stored in it'),
+        make_option('--cache', default='default',
+                    help='Alias of the cache cleared with --clear-cache'),
+        make_option('--live', default=None,
+                    help='Base URL of a running server to crawl instead of using the test client'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError('Provide the path of a sitemap index')
+        simulation = CrawlSimulation(args[0], options['clients'], options['host'], options['secure'], options['live'])
+        if not options['live']:
+            # The cache may hold sessions and other data of the project, so it is only cleared when asked
+            if options['clear_cache']:
+                get_cache(options['cache']).clear()
+            get_fragment_cache().clear()
+        self.stdout.write(format_report('cold', simulation.run()))
+        for i in range(options['rounds']):
+            self.stdout.write(format_report('warm', simulation.run()))
@@ -0,0 +1,32 @@
+from threading import Lock
+
+from .settings import CONFIG
+from .utils import import_string
+
+_lock = Lock()
+_counters = {}
+
+
+def incr(name, value=1):
+    """
+    Increments the named counter in this process and passes the increment on
+    to the function set as SITEMAPS_CONFIG['METRICS'], eg to forward it to statsd.
+    """
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+    backend = CONFIG()['METRICS']
+    if backend:
+        import_string(backend)(name, value)
+
+
+def get_metrics():
+    """
+    Returns a dictionary of the counters in this process
+    """
+    with _lock:
+        return dict(_counters)
+
+
+def reset():
+    with _lock:
+        _counters.clear()
@@ -0,0 +1,19 @@
+from django.db import models
+
+
+class StoredSitemap(models.Model):
+    """
+    A rendered sitemap page persisted by ``sitemapext.storage.DatabaseStorage``
+    """
+    key = models.CharField(max_length=255, unique=True)
+    content = models.TextField()
+    lastmod = models.DateTimeField(null=True, blank=True)
+    url_count = models.PositiveIntegerField(default=0)
+    size = models.PositiveIntegerField(default=0)
+    checksum = models.CharField(max_length=40)
+    fingerprint = models.CharField(max_length=32, blank=True, default='')
+    built = models.DateTimeField()
+
+    def __unicode__(self):
+        return self.key
+    __str__ = __unicode__
@@ -0,0 +1,134 @@
+from time import time
+from threading import Lock
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+from django.core.urlresolvers import reverse, get_script_prefix, get_urlconf
+
+from .settings import CONFIG
+from .utils import OrderedDict
+
+
+def set_count(paginator, count):
+    # Paginator.count reads _count on older Django versions and is a cached_property on newer ones
+    if hasattr(paginator, '_count'):
+        paginator._count = count
+    else:
+        paginator.__dict__['count'] = count
+
+
+class Section(object):
+    """
+    The compiled view, builder and cached metadata of one section of a registry
+    """
+
+    def __init__(self, name, view_class):
+        self.name = name
+        self.view_class = view_class
+        self.view = view_class.as_view()
+        self.builder_class = getattr(view_class, 'builder_class', None)
+        self.urls = {}
+        self.counts = {}
+        self.stats = {'requests': 0, 'counts': 0, 'cached_counts': 0, 'invalidations': 0}
+
+
+class SitemapRegistry(Mapping):
+    """
+    Holds the sections of a sitemaps dictionary, built once so requests do not construct view functions
+    or reverse URLs again. Reads like the sitemaps dictionary and can be passed to the views in its place.
+    The object count of each section is cached for count_timeout seconds (SITEMAPS_CONFIG['COUNT_TIMEOUT']
+    by default), per database, until the section is invalidated.
+    """
+
+    def __init__(self, sitemaps, count_timeout=None):
+        self.sitemaps = dict(sitemaps)
+        self.sections = OrderedDict([(name, Section(name, view_class)) for name, view_class in sitemaps.items()])
+        self.count_timeout = CONFIG()['COUNT_TIMEOUT'] if count_timeout is None else count_timeout
+        self.lock = Lock()
+
+    def __getitem__(self, name):
+        return self.sections[name].view_class
+
+    def __iter__(self):
+        return iter(self.sections)
+
+    def __len__(self):
+        return len(self.sections)
+
+    def get_view(self, name):
+        """
+        Returns the view function of a section, raising KeyError for unknown sections
+        """
+        section = self.sections[name]
+        with self.lock:
+            section.stats['requests'] += 1
+        return section.view
+
+    def get_url(self, generator, name):
+        """
+        Returns the URL of the first page of a section, reversed once per URLconf and script prefix
+        """
+        urls = self.sections[name].urls
+        key = (get_urlconf(), get_script_prefix(), generator)
+        if key not in urls:
+            urls[key] = reverse(generator, kwargs={'section': name})
+        return urls[key]
+
+    def get_paginator(self, name, view):
+        """
+        Returns the paginator of a section's view instance, with the cached object count when there is one
+        """
+        section = self.sections[name]
+        paginator = view.get_paginator(view.get_queryset(), view.paginate_by)
+        if not self.count_timeout:
+            return paginator
+        using = view.get_using() if hasattr(view, 'get_using') else None
+        with self.lock:
+            count, counted = section.counts.get(using, (None, None))
+        if counted is not None and time() - counted < self.count_timeout:
+            set_count(paginator, count)
+            with self.lock:
+                section.stats['cached_counts'] += 1
+            return paginator
+        count = paginator.count
+        with self.lock:
+            section.counts[using] = (count, time())
+            section.stats['counts'] += 1
+        return paginator
+
+    def invalidate(self, name=None):
+        """
+        Drops the cached object counts of a section, or of every section
+        """
+        with self.lock:
+            for section in ([self.sections[name]] if name is not None else self.sections.values()):
+                section.counts.clear()
+                section.stats['invalidations'] += 1
+
+    def get_stats(self):
+        """
+        Returns a dictionary of the request and count statistics of each section
+        """
+        with self.lock:
+            return dict([(name, dict(section.stats)) for name, section in self.sections.items()])
+
+
+_registries = {}
+_registries_lock = Lock()
+
+
+def get_registry(sitemaps):
+    """
+    Returns the registry of a sitemaps dictionary, built the first time the dictionary is used.
+    Registries are returned as is.
+    """
+    if isinstance(sitemaps, SitemapRegistry):
+        return sitemaps
+    with _registries_lock:
+        registry = _registries.get(id(sitemaps))
+        # The dictionary may have been changed, or garbage collected and its id reused
+        if registry is None or registry.sitemaps != sitemaps:
+            registry = _registries[id(sitemaps)] = SitemapRegistry(sitemaps)
+        return registry
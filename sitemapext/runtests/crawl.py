@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+"""
+Fills a database with generated objects and simulates a crawl burst against the sitemaps of the test suite.
+
+    $ python sitemapext/runtests/crawl.py --objects=100000 --clients=20
+
+Uses a SQLite database file by default. Pass --settings with a settings module of your own to use PostgreSQL.
+"""
+import os
+import sys
+from optparse import OptionParser
+from tempfile import mkstemp
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "../.."))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'sitemapext.runtests.settings')
+
+parser = OptionParser(usage='%prog [options]')
+parser.add_option('--objects', type='int', default=10000, help='Number of objects to generate')
+parser.add_option('--clients', type='int', default=10, help='Number of crawlers fetching every page at once')
+parser.add_option('--rounds', type='int', default=1, help='Number of warm crawls after the cold one')
+parser.add_option('--paginate-by', type='int', default=1000, help='Number of URLs per sitemap page')
+parser.add_option('--cache-timeout', type='int', default=None, help='cache_timeout of the sitemap views')
+parser.add_option('--database', default=None, help='Path of the SQLite database file, a temporary one by default')
+parser.add_option('--settings', default=None, help='Settings module to use instead of the test settings')
+
+
+def get_urlpatterns(paginate_by, cache_timeout):
+    try:
+        from django.conf.urls.defaults import patterns, url
+    except ImportError:
+        from django.conf.urls import patterns, url
+
+    from sitemapext import SitemapIndex, SitemapGenerator, SitemapRegistry
+    from sitemapext.tests import ModelSitemapView, ModelNewsSitemapView, ModelImageSitemapView
+
+    sitemaps = {}
+    for name, view in (('simple', ModelSitemapView), ('news', ModelNewsSitemapView), ('image', ModelImageSitemapView)):
+        sitemaps[name] = type(view.__name__, (view,), {'paginate_by': paginate_by, 'cache_timeout': cache_timeout})
+    sitemaps = SitemapRegistry(sitemaps)
+    return patterns('',
+        url(r'^sitemap-index\.xml$', SitemapIndex.as_view(cache_timeout=cache_timeout),
+            {'sitemaps': sitemaps, 'generator': 'sitemap-generator'}),
+        url(r'^sitemap-(?P<section>.+)\.xml$', SitemapGenerator.as_view(),
+            {'sitemaps': sitemaps}, name='sitemap-generator'),
+    )
+
+
+def main():
+    options, args = parser.parse_args()
+    if options.settings:
+        os.environ['DJANGO_SETTINGS_MODULE'] = options.settings
+
+    from django.conf import settings
+
+    settings.ROOT_URLCONF = 'sitemapext.runtests.crawl'
+    settings.ALLOWED_HOSTS = ['*']
+    temporary = None
+    if settings.DATABASES['default']['ENGINE'].endswith('sqlite3'):
+        if options.database is None:
+            fd, temporary = mkstemp(suffix='.db')
+            os.close(fd)
+        settings.DATABASES['default']['NAME'] = options.database or temporary
+
+    from django.core.management import call_command
+    from sitemapext.tests import Model
+    from sitemapext.simulation import CrawlSimulation, format_report
+    from sitemapext.runtests import crawl
+
+    # This script runs as __main__, so the urlconf is set on the module Django imports
+    crawl.urlpatterns = get_urlpatterns(options.paginate_by, options.cache_timeout)
+    try:
+        call_command('syncdb', interactive=False, verbosity=0)
+        count = Model.objects.count()
+        if count < options.objects:
+            sys.stdout.write('Creating %s objects\n' % (options.objects - count))
+            Model.objects.bulk_create([
+                Model(name='crawl-%s' % i, pub_date='2010-01-01 12:00:00', update_date='2013-01-01 12:00:00')
+                for i in range(count, options.objects)
+            ])
+        simulation = CrawlSimulation('/sitemap-index.xml', options.clients, 'example.com')
+        sys.stdout.write(format_report('cold', simulation.run()) + '\n')
+        for i in range(options.rounds):
+            sys.stdout.write(format_report('warm', simulation.run()) + '\n')
+    finally:
+        if temporary:
+            os.remove(temporary)
+
+
+if __name__ == '__main__':
+    main()
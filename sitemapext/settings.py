@@ -25,6 +25,29 @@ def CONFIG():
         'DEBUG': settings.DEBUG,
         'MAX_SIZE':  (10 * 1024 * 1024) - 5120,  # 10MB limit with 500K safety room
         'PRETTY': True,
+        'HOST_AGNOSTIC': False,  # Render and cache pages once for all hosts, adding the host to each response
+        'VALIDATION': 'log',  # 'log' every invalid value, 'summary' to log once per page, 'trusted' to skip checks
+        'CHUNK_SIZE': 500,  # Number of objects rendered before their elements are serialized and freed
+        'COUNT_TIMEOUT': 0,  # Seconds the object count of each section is cached for the index, 0 to count every time
+        'SITEMAPS': None,  # Dotted path to the sitemaps dictionary warmed up when Django starts
+        'DATABASE_ROUTER': None,  # Dotted path to a function returning the database alias for a sitemap view
+        'FRAGMENT_CACHE': None,  # Alias of the shared Django cache backing the fragment cache
+        'FRAGMENT_CACHE_SIZE': 100000,  # Number of fragments kept in the in-process fragment cache
+        'FRAGMENT_CACHE_TIMEOUT': 24 * 60 * 60,  # Timeout of fragments in the shared cache
+        'MAX_RENDERS': None,  # Maximum number of sitemaps rendered at the same time in each process
+        'MAX_SHARED_RENDERS': None,  # Maximum number of sitemaps rendered at the same time across all processes
+        'RENDER_QUEUE_TIMEOUT': 5,  # Seconds a request waits for a render slot before a 503 is returned
+        'RENDER_LOCK_CACHE': 'default',  # Alias of the cache holding the shared render slots
+        'RENDER_LOCK_TIMEOUT': 300,  # Seconds after which a shared render slot is freed if it was never released
+        'RETRY_AFTER': 120,  # Retry-After seconds sent with 503 responses
+        'METRICS': None,  # Dotted path to a function called with the name and increment of every metric
+        'STORAGE': None,  # Dotted path to a sitemapext.storage backend class
+        'STORAGE_ROOT': 'sitemaps',  # Directory used by FileSystemStorage
+        'SENDFILE': None,  # Serve stored files with 'x-accel-redirect', 'x-sendfile' or a streamed 'file' response
+        'SENDFILE_URL': '/sitemaps/',  # Internal URL of STORAGE_ROOT in the front-end server, for X-Accel-Redirect
+        'REBUILD_RUNNER': 'sitemapext.tasks.ThreadRunner',  # Dotted path to a runner, or a callable returning one
+        'REBUILD_WORKERS': 4,  # Number of worker threads used by ThreadRunner
+        'DEDUP_ERROR_RATE': 1e-6,  # False positive rate of the Bloom filter used by deduplicating rebuilds
     }
     defaults.update(getattr(settings, 'SITEMAPS_CONFIG', {}))
     return defaults
\ No newline at end of file
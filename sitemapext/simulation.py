@@ -0,0 +1,148 @@
+from math import ceil
+from time import time
+from threading import Thread, Lock
+try:
+    from urllib.parse import urlsplit
+    from urllib.request import urlopen
+except ImportError:
+    from urlparse import urlsplit
+    from urllib2 import urlopen
+try:
+    import resource
+except ImportError:
+    resource = None
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from lxml import etree
+from django.db import connection
+from django.test.client import Client
+
+from . import metrics
+
+SITEMAP_NS = 'http://www.sitemaps.org/schemas/sitemap/0.9'
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[max(int(ceil(fraction * len(values))) - 1, 0)]
+
+
+class CrawlSimulation(object):
+    """
+    Simulates a burst of crawlers: each of the clients fetches the index, any child indexes it lists and then
+    every sitemap page, all at the same time.
+    Requests go through the Django test client, or to a running server when base_url is given,
+    in which case query counts and cache hits are not measured.
+    """
+
+    def __init__(self, index_url, clients=10, host='localhost', secure=False, base_url=None):
+        self.index_url = index_url
+        self.clients = clients
+        self.host = host
+        self.secure = secure
+        self.base_url = base_url and base_url.rstrip('/')
+        self.lock = Lock()
+
+    def fetch(self, client, url):
+        """
+        Returns the status, content and number of queries of a request
+        """
+        parts = urlsplit(url)
+        path = parts.path + ('?%s' % parts.query if parts.query else '')
+        if self.base_url:
+            response = urlopen(self.base_url + path)
+            return response.getcode(), response.read(), None
+        response = client.get(path, HTTP_HOST=self.host, **{'wsgi.url_scheme': 'https' if self.secure else 'http'})
+        content = b''.join(response.streaming_content) if getattr(response, 'streaming', False) else response.content
+        # The queries of the thread's connection are reset when each request starts
+        return response.status_code, content, len(connection.queries)
+
+    def request(self, client, url, results):
+        start = time()
+        try:
+            status, content, queries = self.fetch(client, url)
+        except Exception:
+            status, content, queries = None, b'', None
+        with self.lock:
+            results.append((url, status, time() - start, queries))
+        return content if status == 200 else None
+
+    def crawl(self, results):
+        """
+        Crawls the index and every page it lists, recording the result of each request
+        """
+        client = Client()
+        connection.use_debug_cursor = True
+        try:
+            pending = [self.index_url]
+            while pending:
+                content = self.request(client, pending.pop(0), results)
+                # Only indexes are parsed, for the URLs of their child indexes and sitemap pages
+                if content is None or not b'<sitemapindex' in content[:1024]:
+                    continue
+                pending.extend([loc.text for loc in etree.fromstring(content).iter('{%s}loc' % SITEMAP_NS)])
+        finally:
+            connection.close()
+
+    def run(self):
+        """
+        Runs one crawl burst and returns a report of it
+        """
+        results = []
+        metrics.reset()
+        if tracemalloc is not None:
+            tracemalloc.start()
+        start = time()
+        threads = [Thread(target=self.crawl, args=(results,)) for i in range(self.clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return self.report(results, time() - start)
+
+    def report(self, results, duration):
+        latencies = [latency for url, status, latency, queries in results]
+        queries = [count for url, status, latency, count in results if count is not None]
+        rendered = metrics.get_metrics().get('pages_rendered', 0)
+        ok = len([status for url, status, latency, count in results if status == 200])
+        report = {
+            'requests': len(results),
+            'errors': len(results) - ok,
+            'duration': duration,
+            'p50': percentile(latencies, .5),
+            'p99': percentile(latencies, .99),
+            'max': max(latencies) if latencies else None,
+            'queries': sum(queries) / float(len(queries)) if queries else None,
+            'rendered': rendered,
+            'hit_ratio': 1 - rendered / float(ok) if ok and not self.base_url else None,
+            'peak_memory': None,
+        }
+        if tracemalloc is not None:
+            report['peak_memory'] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        elif resource is not None:
+            # Peak resident size of the whole process so far, in kilobytes on Linux
+            report['peak_memory'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        return report
+
+
+def format_report(name, report):
+    """
+    Returns a one line summary of a report
+    """
+    def ms(value):
+        return '-' if value is None else '%.1fms' % (value * 1000)
+
+    def number(value, format='%.2f'):
+        return '-' if value is None else format % value
+
+    return ('%s: %s requests (%s errors) in %.2fs, p50 %s, p99 %s, max %s, %s queries/request, '
+            '%s rendered, cache hit ratio %s, peak memory %s' % (
+                name, report['requests'], report['errors'], report['duration'], ms(report['p50']), ms(report['p99']),
+                ms(report['max']), number(report['queries']), report['rendered'], number(report['hit_ratio']),
+                number(report['peak_memory'] and report['peak_memory'] / 1024. / 1024., '%.1fMB')))
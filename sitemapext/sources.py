@@ -0,0 +1,311 @@
+import os
+import heapq
+from hashlib import md5
+from itertools import islice
+from threading import Thread, Event
+try:
+    from queue import Queue, Full
+except ImportError:
+    from Queue import Queue, Full
+
+from django.db import connections
+
+from .entries import SitemapEntry
+from .fragments import LRUCache
+from .utils import get_cache, force_text
+
+
+class IterableSource(object):
+    """
+    Lets any iterable stand in for the queryset of a sitemap view, so URLs can come from a search index,
+    a key-value store or a file instead of the database.
+    iterable is either an iterable or a function returning a fresh iterator each time it is called.
+    length is the number of items, or a function returning it, and avoids counting the items by iterating over them.
+    getslice is an optional function taking start and stop indexes and returning an iterable of those items,
+    for sources with random access. Otherwise pages are read by skipping over the preceding items.
+    """
+
+    def __init__(self, iterable, length=None, getslice=None):
+        self.iterable = iterable
+        self.length = length
+        self.getslice = getslice
+
+    def __iter__(self):
+        if callable(self.iterable):
+            return iter(self.iterable())
+        return iter(self.iterable)
+
+    def count(self):
+        if self.length is None:
+            self.length = sum(1 for item in self)
+        elif callable(self.length):
+            return self.length()
+        return self.length
+
+    def __len__(self):
+        return self.count()
+
+    def bounds(self, key):
+        """
+        Returns the start and stop indexes of a slice, clipped to the number of items
+        """
+        count = self.count()
+        start = min(key.start or 0, count)
+        stop = count if key.stop is None else min(key.stop, count)
+        return start, max(stop, start)
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            return list(self[key:key + 1])[0]
+        start, stop = self.bounds(key)
+        if self.getslice is None:
+            return IterableSource(lambda: islice(self, start, stop), stop - start)
+        return IterableSource(lambda: self.getslice(start, stop), stop - start)
+
+
+class FileSource(IterableSource):
+    """
+    Reads a flat file with one URL path per line, yielding a SitemapEntry for each line.
+    Unless a length is given, the lines are counted again whenever the file is modified.
+    """
+
+    def __init__(self, path, length=None):
+        self.path = path
+        self.counted = None
+        super(FileSource, self).__init__(self.read, length)
+
+    def count(self):
+        if self.length is not None:
+            return super(FileSource, self).count()
+        stat = os.stat(self.path)
+        version = (stat.st_mtime, stat.st_size)
+        if self.counted is None or self.counted[0] != version:
+            self.counted = (version, sum(1 for item in self))
+        return self.counted[1]
+
+    def read(self):
+        with open(self.path) as lines:
+            for line in lines:
+                line = line.strip()
+                if line:
+                    yield SitemapEntry(line)
+
+
+class Descending(object):
+    """
+    Wraps a key so it sorts in descending order in the merge
+    """
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+    def __ne__(self, other):
+        return self.value != other.value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+    def __gt__(self, other):
+        return other.value > self.value
+
+
+class ShardedSource(IterableSource):
+    """
+    Merges the rows of a queryset from several databases with identical schemas into one stream ordered by key,
+    so a single section can span all the shards with evenly sized pages.
+    key must be a field that is unique within each shard, prefixed with '-' for descending order.
+    Ties between shards are broken by their order in aliases.
+    Each shard is read sequentially in keyset batches of batch_size rows. With concurrent=True each shard is read
+    by its own thread, one batch ahead of the merge.
+    The position where each page ends is remembered under the source's name, so the next page resumes every shard
+    from there with a keyset filter instead of skipping over the preceding rows, even when it is read by another
+    source instance. Positions are kept in a bounded in-process store, set cache to a Django cache alias to share them
+    between processes too. The name defaults to one made from the model, key, aliases and query.
+    """
+    # Number of earlier page boundaries looked up when the start of a page has no known position
+    lookback = 100
+
+    def __init__(self, queryset, aliases, key='pk', batch_size=1000, concurrent=False, cache=None, name=None):
+        self.queryset = queryset.order_by(key)
+        self.aliases = list(aliases)
+        self.key = key
+        self.field = key.lstrip('-')
+        self.descending = key.startswith('-')
+        self.batch_size = batch_size
+        self.concurrent = concurrent
+        self.cache = cache and get_cache(cache)
+        if name is None:
+            opts = queryset.model._meta
+            query = md5(force_text('%s %s' % (self.aliases, self.queryset.query)).encode('utf-8')).hexdigest()
+            name = '%s.%s.%s.%s' % (opts.app_label, opts.object_name, key, query[:12])
+        self.name = name
+        super(ShardedSource, self).__init__(None)
+
+    def count(self):
+        if self.length is None:
+            self.length = sum([self.queryset.using(alias).count() for alias in self.aliases])
+        return self.length
+
+    def get_key(self, obj):
+        if self.field == 'pk':
+            return obj.pk
+        return getattr(obj, self.field)
+
+    def fetch(self, alias, after=None, inclusive=False):
+        """
+        Returns the next batch of rows of a shard, starting after (or at) the given key in the order of the key
+        """
+        queryset = self.queryset.using(alias)
+        if after is not None:
+            lookup = ('lte' if inclusive else 'lt') if self.descending else ('gte' if inclusive else 'gt')
+            queryset = queryset.filter(**{'%s__%s' % (self.field, lookup): after})
+        return list(queryset[:self.batch_size])
+
+    def close(self, alias):
+        """
+        Closes the database connection a prefetching thread opened to a shard
+        """
+        connections[alias].close()
+
+    def iter_batches(self, alias, after=None, inclusive=False):
+        while True:
+            batch = self.fetch(alias, after, inclusive)
+            yield batch
+            if len(batch) < self.batch_size:
+                return
+            after, inclusive = self.get_key(batch[-1]), False
+
+    def iter_shard(self, shard, after=None, inclusive=False):
+        """
+        Yields the (key, shard, sequence, object) tuples of a shard that are merged
+        """
+        batches = self.iter_batches(self.aliases[shard], after, inclusive)
+        if self.concurrent:
+            batches = prefetch(batches, lambda: self.close(self.aliases[shard]))
+        sequence = 0
+        for batch in batches:
+            for obj in batch:
+                key = self.get_key(obj)
+                yield Descending(key) if self.descending else key, shard, sequence, obj
+                sequence += 1
+
+    def merge(self, position=None):
+        """
+        Yields the merged rows of all shards, starting after the (key, shard) position
+        """
+        streams = []
+        for shard in range(len(self.aliases)):
+            if position is None:
+                streams.append(self.iter_shard(shard))
+            else:
+                streams.append(self.iter_shard(shard, position[0], shard > position[1]))
+        for item in heapq.merge(*streams):
+            yield item
+
+    def position_key(self, index):
+        return 'sitemapext.shard.%s.%s' % (self.name, index)
+
+    def get_positions(self, indexes):
+        """
+        Returns a dictionary of the known positions of the indexes, from the in-process store then the cache
+        """
+        keys = dict([(self.position_key(index), index) for index in indexes])
+        found = _positions.get_many(keys)
+        if self.cache:
+            missing = [key for key in keys if key not in found]
+            if missing:
+                shared = self.cache.get_many(missing)
+                _positions.set_many(shared)
+                found.update(shared)
+        return dict([(keys[key], position) for key, position in found.items()])
+
+    def set_position(self, index, position):
+        key = self.position_key(index)
+        _positions.set_many({key: position})
+        if self.cache:
+            self.cache.set(key, position)
+
+    def iter_slice(self, start, stop):
+        """
+        Yields the rows from start to stop, resuming from the position where the slice starts when it is known,
+        otherwise from the nearest earlier page boundary that is known
+        """
+        if start >= stop:
+            return
+        index, position = start, None
+        if start:
+            size = stop - start
+            indexes = [start] + list(range(start - size, 0, -size))[:self.lookback]
+            positions = self.get_positions(indexes)
+            if positions:
+                index = max(positions)
+                position = positions[index]
+            else:
+                index = 0
+        for key, shard, sequence, obj in self.merge(position):
+            if index >= start:
+                yield obj
+            index += 1
+            if index == stop:
+                self.set_position(stop, (self.get_key(obj), shard))
+                break
+
+    def __iter__(self):
+        return (item[-1] for item in self.merge())
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            return list(self[key:key + 1])[0]
+        start, stop = self.bounds(key)
+        return IterableSource(lambda: self.iter_slice(start, stop), stop - start)
+
+
+# Number of page end positions of sharded sources kept in each process
+POSITIONS_SIZE = 10000
+_positions = LRUCache(POSITIONS_SIZE)
+
+
+def prefetch(batches, close):
+    """
+    Reads the batches on a separate thread, one batch ahead of the consumer.
+    close is called on that thread once it is done.
+    """
+    queue = Queue(1)
+    stop = Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                queue.put(item, timeout=.1)
+                return True
+            except Full:
+                pass
+
+    def produce():
+        try:
+            for batch in batches:
+                if not put((batch, None)):
+                    return
+            put((None, None))
+        except Exception as e:
+            put((None, e))
+        finally:
+            close()
+
+    thread = Thread(target=produce)
+    thread.daemon = True
+    thread.start()
+    try:
+        while True:
+            batch, error = queue.get()
+            if error is not None:
+                raise error
+            if batch is None:
+                return
+            yield batch
+    finally:
+        stop.set()
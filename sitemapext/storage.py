@@ -0,0 +1,290 @@
+import os
+import json
+from hashlib import sha1
+from tempfile import mkstemp
+
+from .settings import CONFIG
+from .utils import import_string, now, parse_datetime
+
+# Number of keys looked up per query, below the 999 variables SQLite allows in a statement
+KEY_BATCH_SIZE = 500
+
+
+class StoredPage(object):
+    """
+    A rendered sitemap page along with the metadata recorded when it was built.
+    The checksum hashes the content and the fingerprint hashes the markup of every URL element on the page,
+    so together they make up the manifest used to skip writing unchanged pages when rebuilding.
+    """
+    def __init__(self, key, content, lastmod=None, url_count=0, size=None, checksum=None, built=None, path=None,
+                 fingerprint=None):
+        self.key = key
+        self.content = content
+        self.lastmod = lastmod
+        self.url_count = url_count
+        self.size = len(content) if size is None else size
+        self.checksum = checksum or BaseStorage.checksum(content)
+        self.built = built
+        self.path = path
+        self.fingerprint = fingerprint
+
+
+class BaseStorage(object):
+    """
+    Storage backends persist rendered sitemap pages keyed by section and page number.
+    Subclasses must implement get, save, delete and purge.
+    """
+
+    @staticmethod
+    def checksum(content):
+        return sha1(content).hexdigest()
+
+    def get(self, key):
+        """
+        Returns the StoredPage for the key or None if it has not been built
+        """
+        raise NotImplementedError
+
+    def get_meta(self, key):
+        """
+        Returns the StoredPage for the key without loading its content, or None if it has not been built
+        """
+        return self.get(key)
+
+    def get_many(self, keys):
+        """
+        Returns a list of StoredPages (or None for missing pages) in the same order as the keys
+        """
+        return [self.get(key) for key in keys]
+
+    def get_many_meta(self, keys):
+        """
+        Returns a list of StoredPages without their content (or None for missing pages) in the same order as the keys
+        """
+        return [self.get_meta(key) for key in keys]
+
+    def save(self, key, content, lastmod=None, url_count=0, fingerprint=None):
+        """
+        Stores the rendered content for the key and returns the new StoredPage
+        """
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def purge(self, keep, prefix=''):
+        """
+        Deletes the pages stored under the prefix (the protocol and domain of a host) whose key is not in keep,
+        along with pages stored without a host by earlier versions. Returns the number of pages deleted.
+        """
+        raise NotImplementedError
+
+    @staticmethod
+    def is_stale(key, keep, prefix):
+        return key not in keep and ('://' not in key or bool(prefix) and key.startswith('%s/' % prefix))
+
+
+class DatabaseStorage(BaseStorage):
+    """
+    Stores pages in the StoredSitemap model. Requires sitemapext in INSTALLED_APPS.
+    """
+
+    def _page(self, obj, content=True):
+        return StoredPage(obj.key, obj.content.encode('utf-8') if content else None, obj.lastmod,
+                          obj.url_count, obj.size, obj.checksum, obj.built, fingerprint=obj.fingerprint or None)
+
+    def get(self, key):
+        from .models import StoredSitemap
+
+        try:
+            return self._page(StoredSitemap.objects.get(key=key))
+        except StoredSitemap.DoesNotExist:
+            return None
+
+    def get_meta(self, key):
+        from .models import StoredSitemap
+
+        try:
+            return self._page(StoredSitemap.objects.defer('content').get(key=key), False)
+        except StoredSitemap.DoesNotExist:
+            return None
+
+    def _get_many(self, keys, content):
+        from .models import StoredSitemap
+
+        queryset = StoredSitemap.objects.all() if content else StoredSitemap.objects.defer('content')
+        pages = {}
+        for i in range(0, len(keys), KEY_BATCH_SIZE):
+            for obj in queryset.filter(key__in=keys[i:i + KEY_BATCH_SIZE]):
+                pages[obj.key] = self._page(obj, content)
+        return [pages.get(key) for key in keys]
+
+    def get_many(self, keys):
+        return self._get_many(keys, True)
+
+    def get_many_meta(self, keys):
+        return self._get_many(keys, False)
+
+    def save(self, key, content, lastmod=None, url_count=0, fingerprint=None):
+        from .models import StoredSitemap
+
+        try:
+            obj = StoredSitemap.objects.get(key=key)
+        except StoredSitemap.DoesNotExist:
+            obj = StoredSitemap(key=key)
+        obj.content = content.decode('utf-8')
+        obj.lastmod = lastmod
+        obj.url_count = url_count
+        obj.size = len(content)
+        obj.checksum = self.checksum(content)
+        obj.fingerprint = fingerprint or ''
+        obj.built = now()
+        obj.save()
+        return self._page(obj)
+
+    def delete(self, key):
+        from .models import StoredSitemap
+
+        StoredSitemap.objects.filter(key=key).delete()
+
+    def purge(self, keep, prefix=''):
+        from .models import StoredSitemap
+
+        keep = set(keep)
+        stale = [key for key in StoredSitemap.objects.values_list('key', flat=True).iterator()
+                 if self.is_stale(key, keep, prefix)]
+        for i in range(0, len(stale), KEY_BATCH_SIZE):
+            StoredSitemap.objects.filter(key__in=stale[i:i + KEY_BATCH_SIZE]).delete()
+        return len(stale)
+
+
+class FileSystemStorage(BaseStorage):
+    """
+    Stores pages as XML files under STORAGE_ROOT with a JSON metadata file alongside each one.
+    Each version of a page gets its own XML file, named after its checksum, which the metadata points to.
+    Both files are written to a unique temporary file and renamed into place, so readers always see
+    a complete page along with its own metadata. The previous version is kept for readers that are still on it.
+    """
+
+    def __init__(self, root=None):
+        self.root = root or CONFIG()['STORAGE_ROOT']
+
+    @staticmethod
+    def name(key):
+        return key.replace('://', '.').strip('/').replace('/', '_').replace(':', '-')
+
+    def path(self, key, ext='xml', checksum=None):
+        name = self.name(key)
+        if checksum:
+            name = '%s.%s' % (name, checksum[:12])
+        return os.path.join(self.root, '%s.%s' % (name, ext))
+
+    def get(self, key):
+        return self._get(key, True)
+
+    def get_meta(self, key):
+        return self._get(key, False)
+
+    def _meta(self, key):
+        return self._load(self.path(key, 'json'))
+
+    def _load(self, path):
+        try:
+            with open(path) as meta:
+                return json.load(meta)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def _get(self, key, content):
+        meta = self._meta(key)
+        if meta is None:
+            return None
+        path = os.path.join(self.root, meta['file']) if meta.get('file') else self.path(key)
+        if content:
+            try:
+                with open(path, 'rb') as xml:
+                    content = xml.read()
+            except (IOError, OSError):
+                return None
+        else:
+            content = None
+        lastmod = meta['lastmod'] and parse_datetime(meta['lastmod'])
+        return StoredPage(key, content, lastmod, meta['url_count'], meta['size'],
+                          meta['checksum'], parse_datetime(meta['built']), path, meta.get('fingerprint'))
+
+    def write(self, path, data):
+        """
+        Writes the data to a temporary file unique to this write and renames it to the path
+        """
+        fd, tmp = mkstemp(dir=self.root, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                out.write(data)
+            # os.rename does not replace existing files on Windows
+            getattr(os, 'replace', os.rename)(tmp, path)
+        except Exception:
+            os.remove(tmp)
+            raise
+
+    def save(self, key, content, lastmod=None, url_count=0, fingerprint=None):
+        if not os.path.isdir(self.root):
+            os.makedirs(self.root)
+        checksum = self.checksum(content)
+        page = StoredPage(key, content, lastmod, url_count, checksum=checksum, built=now(),
+                          path=self.path(key, checksum=checksum), fingerprint=fingerprint)
+        old = self._meta(key) or {}
+        name = os.path.basename(page.path)
+        previous = old.get('file') if old.get('file') != name else old.get('previous')
+        self.write(page.path, content)
+        self.write(self.path(key, 'json'), json.dumps({
+            'file': name,
+            'previous': previous,
+            'lastmod': lastmod and lastmod.isoformat(),
+            'url_count': url_count,
+            'size': page.size,
+            'checksum': checksum,
+            'built': page.built.isoformat(),
+            'fingerprint': fingerprint,
+        }).encode('utf-8'))
+        # The version before the previous one is not referenced by any metadata anymore
+        if old.get('previous') not in (None, name, previous):
+            self.remove(old['previous'])
+        return page
+
+    def remove(self, name):
+        try:
+            os.remove(os.path.join(self.root, name))
+        except OSError:
+            pass
+
+    def delete(self, key):
+        self._delete(os.path.basename(self.path(key, 'json')))
+
+    def _delete(self, name):
+        """
+        Removes the metadata file with the name along with every version of the page it references
+        """
+        meta = self._load(os.path.join(self.root, name)) or {}
+        for filename in (meta.get('file'), meta.get('previous'), '%s.xml' % name[:-len('.json')], name):
+            if filename:
+                self.remove(filename)
+
+    def purge(self, keep, prefix=''):
+        # Keys are only known by their file names here, and pages stored with a host start with its protocol
+        keep = set(os.path.basename(self.path(key, 'json')) for key in keep)
+        host = prefix and '%s_' % self.name(prefix)
+        names = os.listdir(self.root) if os.path.isdir(self.root) else []
+        stale = [name for name in names if name.endswith('.json') and not name.startswith('.tmp-')
+                 and name not in keep and (not name.startswith(('http.', 'https.')) or host and name.startswith(host))]
+        for name in stale:
+            self._delete(name)
+        return len(stale)
+
+
+def get_storage():
+    """
+    Returns an instance of the storage backend configured in SITEMAPS_CONFIG['STORAGE'] or None
+    """
+    path = CONFIG()['STORAGE']
+    if path:
+        return import_string(path)()
@@ -0,0 +1,341 @@
+import logging
+from time import time, sleep
+from threading import Thread
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+
+from django.db import connection
+from django.core.urlresolvers import reverse
+from django.test.client import RequestFactory
+
+from .settings import CONFIG
+from .storage import get_storage
+from .utils import import_string, get_host_prefix, STRING_TYPES
+from .dedup import ExactFilter, BloomFilter
+from .registry import get_registry
+from . import metrics
+
+logger = logging.getLogger('sitemapext')
+
+
+class SyncRunner(object):
+    """
+    Runs each task immediately in the current thread
+    """
+    local = True
+
+    def submit(self, func, *args):
+        func(*args)
+
+    def join(self):
+        pass
+
+
+class ThreadRunner(object):
+    """
+    Runs tasks on a pool of daemon worker threads in the current process.
+    The workers are started by the first task submitted and stopped once join returns.
+    """
+    local = True
+
+    def __init__(self, workers=None):
+        self.workers = workers or CONFIG()['REBUILD_WORKERS']
+        self.queue = Queue()
+        self.threads = []
+
+    def work(self):
+        while True:
+            task = self.queue.get()
+            if task is None:
+                self.queue.task_done()
+                return
+            func, args = task
+            try:
+                func(*args)
+            except Exception:
+                logger.exception('Sitemap rebuild failed')
+            finally:
+                connection.close()
+                self.queue.task_done()
+
+    def submit(self, func, *args):
+        if not self.threads:
+            for i in range(self.workers):
+                thread = Thread(target=self.work)
+                thread.daemon = True
+                thread.start()
+                self.threads.append(thread)
+        self.queue.put((func, args))
+
+    def join(self):
+        self.queue.join()
+        for thread in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+
+class QueueRunner(object):
+    """
+    Hands tasks off to a task queue with an enqueue(func, *args) method returning a job, like an RQ Queue.
+    Tasks run in other processes, so they are submitted as module level functions with plain arguments.
+    join waits until every job submitted is finished or failed, polling every poll_interval seconds.
+    """
+    local = False
+
+    def __init__(self, queue, poll_interval=1):
+        self.queue = queue
+        self.poll_interval = poll_interval
+        self.jobs = []
+
+    def submit(self, func, *args):
+        self.jobs.append(self.queue.enqueue(func, *args))
+
+    def join(self):
+        while self.jobs:
+            self.jobs = [job for job in self.jobs if not (job.is_finished or job.is_failed)]
+            if self.jobs:
+                sleep(self.poll_interval)
+
+
+def get_runner():
+    """
+    Returns the runner configured in SITEMAPS_CONFIG['REBUILD_RUNNER'], the dotted path to either a runner
+    or a callable taking no arguments that returns one, like a runner class or a function creating a QueueRunner
+    """
+    runner = import_string(CONFIG()['REBUILD_RUNNER'])
+    if hasattr(runner, 'submit') and not isinstance(runner, type):
+        return runner
+    return runner()
+
+
+class Rebuilder(object):
+    """
+    Renders sitemap pages outside of the request cycle and saves them to the configured storage,
+    so crawler requests are served prebuilt pages.
+    Without a storage backend, rebuilding fills the view's cache instead.
+    Takes the same sitemaps dictionary and generator/index URL names as the views.
+    Runners outside this process need the dotted path to the sitemaps dictionary instead.
+    With dedup set to 'exact' or 'bloom', rebuild_all drops URLs already rendered by another page or section,
+    using a set of URL digests or a Bloom filter sized for the total number of objects.
+    """
+
+    def __init__(self, sitemaps, generator, index=None, index_class=None, runner=None, host='localhost', secure=False,
+                 using=None, dedup=None):
+        self.path = None
+        if isinstance(sitemaps, STRING_TYPES):
+            self.path, sitemaps = sitemaps, import_string(sitemaps)
+        self.sitemaps = sitemaps
+        self.generator = generator
+        self.index = index
+        self.host = host
+        self.secure = secure
+        self.using = using
+        self.dedup = dedup
+        self.filter = None
+        if index_class is None:
+            from .views import SitemapIndex as index_class
+        self.index_class = index_class
+        self.runner = runner or get_runner()
+        self.factory = RequestFactory(HTTP_HOST=host, **{'wsgi.url_scheme': 'https' if secure else 'http'})
+
+    def build(self, view_class, url, page, **kwargs):
+        request = self.factory.get(url, {'page': page} if page else {})
+        initkwargs = {} if self.using is None else {'using': self.using}
+        if self.filter is not None and hasattr(view_class, 'dedup'):
+            initkwargs['dedup'] = self.filter
+        # Rebuilds are not crawler traffic, so they do not wait for render slots
+        if hasattr(view_class, 'limit_renders'):
+            initkwargs['limit_renders'] = False
+        view = view_class(request=request, args=(), kwargs=kwargs, **initkwargs)
+        if view.get_storage() is None:
+            response = view_class.as_view(**initkwargs)(request, **kwargs)
+        else:
+            response = view.build(request, **kwargs)
+        if response.status_code != 200:
+            logger.error('Rebuilding %s failed with a %s response', request.get_full_path(), response.status_code)
+            metrics.incr('rebuilds_failed')
+        return response
+
+    def rebuild(self, section, page=1):
+        """
+        Renders and stores a single page of a section
+        """
+        url = reverse(self.generator, kwargs={'section': section})
+        return self.build(self.sitemaps[section], url, page if page > 1 else None,
+                          section=section, sitemaps=self.sitemaps)
+
+    def rebuild_index_page(self, page):
+        """
+        Renders and stores a single child index
+        """
+        return self.build(self.index_class, reverse(self.index), page,
+                          sitemaps=self.sitemaps, generator=self.generator)
+
+    def submit(self, section, page):
+        """
+        Submits a task to the runner rebuilding a page of a section, or a child index when section is None
+        """
+        if getattr(self.runner, 'local', True):
+            if section is None:
+                return self.runner.submit(self.rebuild_index_page, page)
+            return self.runner.submit(self.rebuild, section, page)
+        if self.path is None:
+            raise ValueError('Rebuilding on a task queue requires the dotted path to the sitemaps dictionary')
+        if self.filter is not None:
+            raise ValueError('URLs can only be deduplicated by runners in this process')
+        options = {
+            'generator': self.generator,
+            'index': self.index,
+            'index_class': '%s.%s' % (self.index_class.__module__, self.index_class.__name__),
+            'host': self.host,
+            'secure': self.secure,
+            'using': self.using,
+        }
+        self.runner.submit(rebuild_page, self.path, section, page, options)
+
+    def get_paginator(self, section):
+        view = self.sitemaps[section]()
+        if self.using is not None:
+            view.using = self.using
+        return get_registry(self.sitemaps).get_paginator(section, view)
+
+    def get_filter(self):
+        """
+        Returns a new filter of the URLs rendered, or None if URLs are not deduplicated
+        """
+        if self.dedup == 'exact':
+            return ExactFilter()
+        if self.dedup == 'bloom':
+            capacity = sum([self.get_paginator(section).count for section in self.sitemaps])
+            return BloomFilter(max(capacity, 1), CONFIG()['DEDUP_ERROR_RATE'])
+        if self.dedup is not None:
+            raise ValueError('Unknown dedup mode "%s", must be "exact" or "bloom"' % self.dedup)
+
+    def rebuild_section(self, section):
+        """
+        Submits a task to the runner for each page of the section
+        """
+        for page in self.get_paginator(section).page_range:
+            self.submit(section, page)
+
+    def rebuild_index(self):
+        """
+        Renders and stores the index along with any paginated child indexes
+        """
+        if self.index is None:
+            return
+        url = reverse(self.index)
+        kwargs = {'sitemaps': self.sitemaps, 'generator': self.generator}
+        self.build(self.index_class, url, None, **kwargs)
+        view = self.index_class(request=self.factory.get(url), args=(), kwargs=kwargs, using=self.using)
+        num_indexes = view.get_num_indexes(list(view.get_sections()))
+        if num_indexes > 1:
+            for page in range(1, num_indexes + 1):
+                self.submit(None, page)
+
+    def rebuild_all(self):
+        """
+        Rebuilds every section and then the index.
+        When deduplicating, a URL is kept on the first page that renders it, so with a SyncRunner
+        sections take precedence in the order of the sitemaps dictionary.
+        """
+        # Count the objects again, the counts are then cached for the index
+        get_registry(self.sitemaps).invalidate()
+        self.filter = self.get_filter()
+        try:
+            for section in self.sitemaps:
+                self.rebuild_section(section)
+            self.runner.join()
+        finally:
+            dropped, self.filter = self.filter and self.filter.dropped, None
+        if dropped:
+            logger.info('Dropped %s duplicate sitemap URLs', dropped)
+            metrics.incr('urls_deduplicated', dropped)
+        self.rebuild_index()
+        self.runner.join()
+
+    def get_storage_keys(self):
+        """
+        Returns the storage keys of every page and child index a rebuild stores for the host
+        """
+        keys = []
+        for section in self.sitemaps:
+            url = reverse(self.generator, kwargs={'section': section})
+            view = self.sitemaps[section](request=self.factory.get(url), args=(), kwargs={'section': section})
+            if self.using is not None:
+                view.using = self.using
+            if view.get_storage() is not None:
+                paginator = get_registry(self.sitemaps).get_paginator(section, view)
+                keys.extend([view.get_storage_key(page) for page in paginator.page_range])
+        if self.index is not None:
+            kwargs = {'sitemaps': self.sitemaps, 'generator': self.generator}
+            view = self.index_class(request=self.factory.get(reverse(self.index)), args=(), kwargs=kwargs,
+                                    using=self.using)
+            keys.append(view.get_storage_key())
+            num_indexes = view.get_num_indexes(list(view.get_sections()))
+            if num_indexes > 1:
+                keys.extend([view.get_storage_key(page) for page in range(1, num_indexes + 1)])
+        return keys
+
+    def purge(self):
+        """
+        Deletes the pages of the configured storage that a rebuild no longer stores for the host,
+        like pages past the end of a section, along with pages stored without a host by earlier versions.
+        Returns the number of pages deleted.
+        """
+        storage = get_storage()
+        if storage is None:
+            return 0
+        prefix = '' if CONFIG()['HOST_AGNOSTIC'] else get_host_prefix(self.factory.get('/'))
+        deleted = storage.purge(self.get_storage_keys(), prefix)
+        if deleted:
+            logger.info('Deleted %s stale stored sitemap pages', deleted)
+        return deleted
+
+
+def rebuild_page(sitemaps, section, page, options):
+    """
+    Rebuilds a page of a section, or a child index when section is None, from a task queue worker.
+    Takes the dotted path to the sitemaps dictionary and the options of the Rebuilder that submitted it.
+    """
+    options = dict(options, index_class=import_string(options['index_class']), runner=SyncRunner())
+    rebuilder = Rebuilder(sitemaps, **options)
+    if section is None:
+        return rebuilder.rebuild_index_page(page)
+    return rebuilder.rebuild(section, page)
+
+
+class Scheduler(object):
+    """
+    Rebuilds each section every rebuild_interval seconds, as set on its sitemap view.
+    Sections without a rebuild_interval are only built once.
+    The index is rebuilt after any of its sections are.
+    """
+
+    def __init__(self, rebuilder):
+        self.rebuilder = rebuilder
+        self.next_run = dict((section, 0) for section in rebuilder.sitemaps)
+
+    def run_pending(self):
+        """
+        Rebuilds the sections that are due and returns their names
+        """
+        now = time()
+        due = [section for section, next_run in self.next_run.items() if next_run is not None and next_run <= now]
+        for section in due:
+            interval = getattr(self.rebuilder.sitemaps[section], 'rebuild_interval', None)
+            self.next_run[section] = None if interval is None else now + interval
+            self.rebuilder.rebuild_section(section)
+        if due:
+            self.rebuilder.runner.join()
+            self.rebuilder.rebuild_index()
+        return due
+
+    def run_forever(self, interval=1):
+        while True:
+            self.run_pending()
+            sleep(interval)
@@ -1,5 +1,9 @@
+import os
+import shutil
+import pickle
 from time import time
-from datetime import timedelta
+from tempfile import mkdtemp
+from datetime import date, datetime, timedelta
 from contextlib import contextmanager
 
 from django.conf import settings
@@ -17,6 +21,15 @@ except ImportError:
 from django.contrib.sitemaps import GenericSitemap
 
 from .views import SitemapView, SitemapGenerator, SitemapIndex, NewsSitemapView, VideoSitemapView, ImageSitemapView, MobileSitemapView
+from .models import StoredSitemap
+from .entries import SitemapEntry, NewsEntry
+from .sources import IterableSource, FileSource, ShardedSource
+from .tasks import Rebuilder, Scheduler, SyncRunner, ThreadRunner, QueueRunner
+from .fragments import get_fragment_cache
+from .limits import get_limiter
+from .dedup import ExactFilter, BloomFilter
+from .registry import SitemapRegistry, get_registry
+from .utils import OrderedDict
 
 
 class SettingDoesNotExist:
@@ -51,9 +64,15 @@ class Model(models.Model):
         return self.update_date.date()
 
 
+class Tag(models.Model):
+    model = models.ForeignKey(Model, related_name='tags')
+    name = models.TextField()
+
+
 class ModelSitemapView(SitemapView):
     model = Model
     paginate_by = 5
+    lastmod_field = 'update_date'
 
     def priority(self, obj):
         return 1
@@ -107,6 +126,15 @@ class ModelNewsSitemapView(NewsSitemapView):
         return ('NASDAQ:A', 'NASDAQ:B')
 
 
+class NewsRebuildSitemapView(ModelNewsSitemapView):
+    rebuild_interval = 0
+
+
+class WindowNewsSitemapView(ModelNewsSitemapView):
+    window_field = 'pub_date'
+    window_refresh = None
+
+
 class InvalidNewsSitemapView(ModelNewsSitemapView):
     def access(self, obj):
         return 'free like beer'
@@ -115,6 +143,18 @@ class InvalidNewsSitemapView(ModelNewsSitemapView):
         return 'when i feel like it'
 
 
+class InvalidWindowNewsSitemapView(WindowNewsSitemapView):
+    def access(self, obj):
+        return 'free like beer'
+
+
+class PrefetchImageSitemapView(ImageSitemapView):
+    queryset = Model.objects.prefetch_related('tags')
+
+    def images(self, obj):
+        return [{'loc': 'http://www.example.com/%s.jpg' % tag.name} for tag in obj.tags.all()]
+
+
 class ModelVideoSitemapView(VideoSitemapView):
     model = Model
 
@@ -195,6 +235,103 @@ class InvalidVideoSitemapView(ModelVideoSitemapView):
         return -1000
 
 
+PRICES = ModelVideoSitemapView().prices(None)
+
+
+class SharedPricesVideoSitemapView(ModelVideoSitemapView):
+    def prices(self, obj):
+        return PRICES
+
+
+class PrioritySitemapView(ModelSitemapView):
+
+    def priority(self, obj):
+        return .5
+
+
+class AlternatesSitemapView(ModelSitemapView):
+    batches = 0
+
+    def get_alternates(self, objects):
+        AlternatesSitemapView.batches += 1
+        return dict((obj.pk, {'de': '/de/models/%s' % obj.pk, 'en': obj.get_absolute_url()}) for obj in objects)
+
+
+class SingleAlternatesSitemapView(ModelSitemapView):
+
+    def alternates(self, obj):
+        return [('fr', '/fr/models/%s' % obj.pk), ('es', 'https://es.example.org/models/%s' % obj.pk)]
+
+
+class CachedSitemapView(ModelSitemapView):
+    cache_timeout = 60
+
+
+class FragmentCacheSitemapView(ModelSitemapView):
+    fragment_cache = True
+
+
+class StringLastmodFragmentCacheSitemapView(FragmentCacheSitemapView):
+    calls = 0
+
+    def lastmod(self, obj):
+        StringLastmodFragmentCacheSitemapView.calls += 1
+        return '2013-01-01'
+
+
+class OtherFragmentCacheSitemapView(FragmentCacheSitemapView):
+
+    def location(self, obj):
+        return '/others/%s' % obj.pk
+
+
+class EntrySitemapView(ModelSitemapView):
+
+    def get_queryset(self):
+        return Model.objects.values_list('pk', 'name', 'update_date')
+
+    def get_entries(self, object_list):
+        for pk, name, update_date in object_list:
+            yield SitemapEntry('/models/%s' % name, pk=pk, lastmod=update_date.date(), priority=1, changefreq='daily')
+
+
+class StreamedEntrySitemapView(EntrySitemapView):
+    object_lists = []
+
+    def get_context_data(self, **kwargs):
+        context = super(StreamedEntrySitemapView, self).get_context_data(**kwargs)
+        StreamedEntrySitemapView.object_lists.append(context['object_list'])
+        return context
+
+
+class NewsEntrySitemapView(ModelNewsSitemapView):
+    publication = {'name': 'The Example Timesname', 'language': 'en'}
+
+    def get_queryset(self):
+        return Model.objects.values_list('name', 'pub_date')
+
+    def get_entries(self, object_list):
+        for name, pub_date in object_list:
+            yield NewsEntry('/models/%s' % name, title=name, publication_date=pub_date,
+                            publication=self.publication, genres=('PressRelease', 'Blog'))
+
+
+class SourceSitemapView(SitemapView):
+    paginate_by = 5
+    queryset = IterableSource(lambda: (SitemapEntry('/source/%s' % i, priority=.5) for i in range(12)), 12)
+
+
+class ShardedSitemapView(ModelSitemapView):
+    key = 'pk'
+
+    def get_queryset(self):
+        return ShardedSource(Model.objects.all(), ['default', 'default'], key=self.key, batch_size=3)
+
+
+class DescendingShardedSitemapView(ShardedSitemapView):
+    key = '-pk'
+
+
 class ModelImageSitemapView(ImageSitemapView):
     model = Model
 
@@ -234,11 +371,45 @@ sitemaps = {
     'invalid-video': InvalidVideoSitemapView,
 }
 
+rebuild_sitemaps = {
+    'simple': ModelSitemapView,
+    'news': NewsRebuildSitemapView,
+}
+
+registry = SitemapRegistry(OrderedDict([('simple', ModelSitemapView), ('news', ModelNewsSitemapView)]), count_timeout=60)
+
 urlpatterns = patterns('',
     url(r'^sitemap-index\.xml$', SitemapIndex.as_view(),
+        {'sitemaps': sitemaps, 'generator': 'sitemap-generator'}, name='sitemap-index'),
+    url(r'^sitemap-nested-index\.xml$', SitemapIndex.as_view(paginate_by=3),
         {'sitemaps': sitemaps, 'generator': 'sitemap-generator'}),
     url(r'^sitemap-(?P<section>.+)\.xml$', SitemapGenerator.as_view(),
         {'sitemaps': sitemaps}, name='sitemap-generator'),
+    url(r'^entries\.xml$', EntrySitemapView.as_view()),
+    url(r'^streamed-entries\.xml$', StreamedEntrySitemapView.as_view()),
+    url(r'^news-entries\.xml$', NewsEntrySitemapView.as_view()),
+    url(r'^sharded\.xml$', ShardedSitemapView.as_view()),
+    url(r'^sharded-desc\.xml$', DescendingShardedSitemapView.as_view()),
+    url(r'^source\.xml$', SourceSitemapView.as_view()),
+    url(r'^source-index\.xml$', SitemapIndex.as_view(),
+        {'sitemaps': {'source': SourceSitemapView}, 'generator': 'sitemap-generator'}),
+    url(r'^news-window\.xml$', WindowNewsSitemapView.as_view()),
+    url(r'^invalid-news-window\.xml$', InvalidWindowNewsSitemapView.as_view()),
+    url(r'^crawl-index\.xml$', SitemapIndex.as_view(paginate_by=2),
+        {'sitemaps': dict((section, sitemaps[section]) for section in ('simple', 'news', 'video')),
+         'generator': 'sitemap-generator'}),
+    url(r'^registry-index\.xml$', SitemapIndex.as_view(),
+        {'sitemaps': registry, 'generator': 'registry-generator'}),
+    url(r'^registry-(?P<section>.+)\.xml$', SitemapGenerator.as_view(),
+        {'sitemaps': registry}, name='registry-generator'),
+    url(r'^prefetch-images\.xml$', PrefetchImageSitemapView.as_view()),
+    url(r'^alternates\.xml$', AlternatesSitemapView.as_view()),
+    url(r'^single-alternates\.xml$', SingleAlternatesSitemapView.as_view()),
+    url(r'^cached\.xml$', CachedSitemapView.as_view()),
+    url(r'^fragments\.xml$', FragmentCacheSitemapView.as_view()),
+    url(r'^other-fragments\.xml$', OtherFragmentCacheSitemapView.as_view()),
+    url(r'^string-lastmod-fragments\.xml$', StringLastmodFragmentCacheSitemapView.as_view()),
+    url(r'^shared-prices\.xml$', SharedPricesVideoSitemapView.as_view()),
     (r'^django\.xml$', 'django.contrib.sitemaps.views.sitemap', {'sitemaps': genericsitemaps})
 
 )
@@ -284,9 +455,72 @@ class SitemapIndexTest(SitemapTestCase):
         '<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">',
         '<loc>http://example.com/sitemap-simple.xml</loc>',
         '<loc>http://example.com/sitemap-news.xml</loc>',
+        ('<lastmod>2013-01-01T12:00:00', 5),
+    ]
+
+
+class StoredIndexLastmodTest(SitemapIndexTest):
+    contains = SitemapIndexTest.contains[:-1] + [
+        ('<lastmod>2013-01-01T00:00:00', 2),
+        ('<lastmod>2014-01-01T12:00:00', 2),
+        ('<lastmod>2013-01-01T12:00:00', 1),
+    ]
+
+    def test_sitemap(self):
+        from .storage import DatabaseStorage
+
+        DatabaseStorage().save('http://example.com/simple:1', b'<urlset/>', date(2013, 1, 1))
+        DatabaseStorage().save('http://example.com/simple:2', b'<urlset/>', date(2013, 1, 1))
+        Model.objects.filter(pk__lte=5).update(update_date='2014-01-01 12:00:00')
+        with patch_settings(SITEMAPS_CONFIG={'STORAGE': 'sitemapext.storage.DatabaseStorage'}):
+            return super(StoredIndexLastmodTest, self).test_sitemap()
+
+
+class PageLastmodTest(SitemapTestCase):
+    num = 12
+
+    def test_sitemap(self):
+        Model.objects.filter(pk__lte=5).update(update_date='2014-01-01 12:00:00')
+        Model.objects.filter(pk=12).update(update_date='2015-01-01 12:00:00')
+        view = ModelSitemapView()
+        view.queryset = Model.objects.order_by('pk')
+        paginator = view.get_paginator(view.get_queryset(), view.paginate_by)
+        paginator.count
+        with self.assertNumQueries(1):
+            self.assertEqual(view.get_page_lastmods(paginator),
+                             [datetime(2014, 1, 1, 12), datetime(2013, 1, 1, 12), datetime(2015, 1, 1, 12)])
+        self.assertEqual(view.get_page_lastmods(paginator, [2, 3]),
+                         [datetime(2013, 1, 1, 12), datetime(2015, 1, 1, 12)])
+
+    def test_orphans(self):
+        Model.objects.filter(pk=12).update(update_date='2015-01-01 12:00:00')
+        view = ModelSitemapView()
+        view.queryset = Model.objects.order_by('pk')
+        paginator = view.get_paginator(view.get_queryset(), view.paginate_by, orphans=2)
+        self.assertEqual(paginator.num_pages, 2)
+        self.assertEqual(view.get_page_lastmods(paginator), [datetime(2013, 1, 1, 12), datetime(2015, 1, 1, 12)])
+
+
+class NestedSitemapIndexTest(SitemapIndexTest):
+    url = '/sitemap-nested-index.xml'
+    contains = SitemapTestCase.contains + [
+        ('<loc>http://example.com/sitemap-nested-index.xml?page=', 4),
+        ('<sitemap>', 4),
     ]
 
 
+class NestedSitemapIndexPageTest(NestedSitemapIndexTest):
+    url = '/sitemap-nested-index.xml?page=4'
+    contains = SitemapTestCase.contains + [
+        ('<sitemap>', 2),
+    ]
+
+
+class MissingNestedSitemapIndexPageTest(NestedSitemapIndexTest):
+    url = '/sitemap-nested-index.xml?page=5'
+    status_code = 404
+    contains = []
+
 
 class Paginated(SitemapIndexTest):
     contains = SitemapTestCase.contains + [
@@ -327,6 +561,172 @@ class NewsSitemapTest(SitemapTestCase):
     ]
 
 
+class EntrySitemapTest(SimpleSitemapTest):
+    url = '/entries.xml'
+    contains = SimpleSitemapTest.contains + [
+        '<changefreq>daily</changefreq>',
+    ]
+
+
+class StreamedEntrySitemapTest(EntrySitemapTest):
+    url = '/streamed-entries.xml'
+
+    def test_sitemap(self):
+        StreamedEntrySitemapView.object_lists = []
+        response = super(StreamedEntrySitemapTest, self).test_sitemap()
+        # get_entries is handed the rows streamed in batches, so the page's queryset never caches them
+        self.assertTrue(StreamedEntrySitemapView.object_lists)
+        for object_list in StreamedEntrySitemapView.object_lists:
+            self.assertEqual(object_list._result_cache, None)
+        return response
+
+
+class NewsEntrySitemapTest(SitemapTestCase):
+    url = '/news-entries.xml'
+    contains = SitemapTestCase.contains + [
+        '<loc>http://example.com/models/section/page.php&amp;q=name</loc>',
+        '<news:publication>',
+            '<news:name>The Example Timesname</news:name>',
+            '<news:language>en</news:language>',
+        '</news:publication>',
+        '<news:genres>PressRelease, Blog</news:genres>',
+        '<news:publication_date>2010-01-01T12:00:00',
+        '<news:title>section/page.php&amp;q=name</news:title>',
+    ]
+
+    def test_entry_fields(self):
+        entry = NewsEntry('/', title='title')
+        self.assertEqual(entry.title, 'title')
+        self.assertEqual(entry.keywords, None)
+        self.assertRaises(AttributeError, setattr, entry, 'foo', 1)
+        self.assertRaises(TypeError, NewsEntry, '/', foo=1)
+
+
+class SourceSitemapTest(SitemapTestCase):
+    url = '/source.xml?page=3'
+    contains = SitemapTestCase.contains + [
+        ('<url>', 2),
+        '<loc>http://example.com/source/10</loc>',
+        '<loc>http://example.com/source/11</loc>',
+        '<priority>0.5</priority>',
+    ]
+
+    def test_source(self):
+        source = IterableSource(lambda: iter(range(10)))
+        self.assertEqual(source.count(), 10)
+        self.assertEqual(list(source[2:4]), [2, 3])
+        self.assertEqual(len(source[8:20]), 2)
+        self.assertEqual(list(source[8:20]), [8, 9])
+        self.assertEqual(len(source[12:20]), 0)
+        self.assertEqual(source[5], 5)
+        source = IterableSource(range(10), getslice=lambda start, stop: range(start * 10, stop * 10, 10))
+        self.assertEqual(list(source[2:4]), [20, 30])
+
+    def test_file_source(self):
+        path = mkdtemp()
+        try:
+            with open('%s/urls.txt' % path, 'w') as urls:
+                urls.write('/a\n/b\n\n/c\n')
+            source = FileSource('%s/urls.txt' % path)
+            self.assertEqual(source.count(), 3)
+            self.assertEqual([entry.location for entry in source[1:]], ['/b', '/c'])
+            with open('%s/urls.txt' % path, 'a') as urls:
+                urls.write('/d\n')
+            # The file is counted again once it changes
+            self.assertEqual(source.count(), 4)
+        finally:
+            shutil.rmtree(path)
+
+
+class ListShardedSource(ShardedSource):
+    shards = {'a': [1, 4, 5, 9], 'b': [2, 3, 4, 8, 10, 11]}
+
+    def fetch(self, alias, after=None, inclusive=False):
+        rows = [row for row in self.shards[alias] if after is None or row > after or (inclusive and row == after)]
+        return rows[:self.batch_size]
+
+    def get_key(self, obj):
+        return obj
+
+    def count(self):
+        return sum([len(rows) for rows in self.shards.values()])
+
+    def close(self, alias):
+        pass
+
+
+class ShardedSourceTest(SitemapTestCase):
+    num = 10
+    url = '/sharded.xml?page=3'
+    contains = SitemapTestCase.contains + [
+        ('<url>', 5),
+    ]
+
+    def setUp(self):
+        from . import sources
+        super(ShardedSourceTest, self).setUp()
+        sources._positions.clear()
+
+    def test_merge(self):
+        pks = list(Model.objects.order_by('pk').values_list('pk', flat=True))
+        source = ShardedSource(Model.objects.all(), ['default', 'default'], batch_size=3)
+        self.assertEqual(source.count(), 20)
+        self.assertEqual([obj.pk for obj in source], sorted(pks * 2))
+        self.assertEqual([obj.pk for obj in source[5:10]], [pks[2], pks[3], pks[3], pks[4], pks[4]])
+        # The next page resumes both shards from where the previous one ended
+        with self.assertNumQueries(2):
+            self.assertEqual([obj.pk for obj in source[10:15]], [pks[5], pks[5], pks[6], pks[6], pks[7]])
+        # Other instances resume from the same positions
+        source = ShardedSource(Model.objects.all(), ['default', 'default'], batch_size=3)
+        source.count()
+        with self.assertNumQueries(2):
+            self.assertEqual([obj.pk for obj in source[15:20]], [pks[7], pks[8], pks[8], pks[9], pks[9]])
+
+    def test_descending(self):
+        pks = list(Model.objects.order_by('-pk').values_list('pk', flat=True))
+        source = ShardedSource(Model.objects.all(), ['default', 'default'], key='-pk', batch_size=3)
+        self.assertEqual([obj.pk for obj in source], sorted(pks * 2, reverse=True))
+        self.assertEqual([obj.pk for obj in source[5:10]], [pks[2], pks[3], pks[3], pks[4], pks[4]])
+        source = ShardedSource(Model.objects.all(), ['default', 'default'], key='-pk', batch_size=3)
+        source.count()
+        with self.assertNumQueries(2):
+            self.assertEqual([obj.pk for obj in source[10:15]], [pks[5], pks[5], pks[6], pks[6], pks[7]])
+        # Without a known position the page resumes from the nearest earlier page that has one,
+        # reading two batches per shard from the end of source[5:10] instead of three from the start
+        source = ShardedSource(Model.objects.all(), ['default', 'default'], key='-pk', batch_size=3)
+        self.assertEqual([obj.pk for obj in source[20:25]], [])
+        with self.assertNumQueries(4):
+            self.assertEqual([obj.pk for obj in source[16:18]], [pks[8], pks[8]])
+
+    def test_views(self):
+        from django.contrib.sites.models import Site
+        from . import sources
+        Site.objects.get_current()
+        for url in ('/sharded.xml', '/sharded-desc.xml'):
+            sources._positions.clear()
+            with self.assertNumQueries(8):
+                self.assertEqual(self.client.get(url + '?page=3').status_code, 200)
+            self.assertEqual(self.client.get(url + '?page=2').status_code, 200)
+            # Each request builds its own source, page 3 resumes from where page 2 ended
+            with self.assertNumQueries(4):
+                self.assertEqual(self.client.get(url + '?page=3').status_code, 200)
+
+    def test_concurrent(self):
+        for concurrent in (False, True):
+            source = ListShardedSource(Model.objects.all(), ['a', 'b'], batch_size=2, concurrent=concurrent)
+            self.assertEqual(list(source), [1, 2, 3, 4, 4, 5, 8, 9, 10, 11])
+            self.assertEqual(list(source[3:6]), [4, 4, 5])
+            self.assertEqual(list(source[6:9]), [8, 9, 10])
+
+
+class SourceSitemapIndexTest(SitemapTestCase):
+    url = '/source-index.xml'
+    contains = SitemapTestCase.contains + [
+        ('<sitemap>', 3),
+        '<loc>http://example.com/sitemap-source.xml?page=3</loc>',
+    ]
+
+
 class VideoSitemapTest(SitemapTestCase):
     url = '/sitemap-video.xml'
     contains = SitemapTestCase.contains + [
@@ -354,6 +754,15 @@ class VideoSitemapTest(SitemapTestCase):
     ]
 
 
+class SharedPricesVideoSitemapTest(SitemapTestCase):
+    url = '/shared-prices.xml'
+    num = 2
+    contains = SitemapTestCase.contains + [
+        ('<video:price currency="USD" resolution="SD" type="rent">1.99</video:price>', 2),
+        ('<video:price currency="USD" resolution="HD" type="own">10.99</video:price>', 2),
+    ]
+
+
 class ImageSitemapTest(SitemapTestCase):
     url = '/sitemap-image.xml'
     contains = SitemapTestCase.contains + [
@@ -368,6 +777,27 @@ class ImageSitemapTest(SitemapTestCase):
     ]
 
 
+class PrefetchImageSitemapTest(SitemapTestCase):
+    url = '/prefetch-images.xml'
+    num = 5
+    contains = SitemapTestCase.contains + [
+        ('<image:loc>http://www.example.com/tag-', 10),
+    ]
+
+    def setUp(self):
+        super(PrefetchImageSitemapTest, self).setUp()
+        for obj in Model.objects.all():
+            Tag.objects.create(model=obj, name='tag-%s-a' % obj.pk)
+            Tag.objects.create(model=obj, name='tag-%s-b' % obj.pk)
+
+    def test_sitemap(self):
+        self.client.get(self.url)
+        # The page counts, the objects, then the tags of each of the three chunks
+        with self.assertNumQueries(6):
+            with patch_settings(SITEMAPS_CONFIG={'CHUNK_SIZE': 2}):
+                return super(PrefetchImageSitemapTest, self).test_sitemap()
+
+
 class MobileSitemapTest(SitemapTestCase):
     url = '/sitemap-mobile.xml'
     contains = SitemapTestCase.contains + [
@@ -375,6 +805,29 @@ class MobileSitemapTest(SitemapTestCase):
     ]
 
 
+class NamespaceSizeTestCase(SitemapTestCase):
+    num = 2
+
+    def test_sitemap(self):
+        from lxml import etree
+
+        for section in ('news', 'video', 'image', 'mobile'):
+            url = '/sitemap-%s.xml' % section
+            with patch_settings(SITEMAPS_CONFIG={'PRETTY': False}):
+                two = self.client.get(url).content
+                Model.objects.all()[0].delete()
+                one = self.client.get(url).content
+            Model.objects.create(name=self.name, pub_date=self.pub_date, update_date=self.update_date)
+            # Namespaces are only declared once on the root urlset
+            self.assertEqual(two.count(b'xmlns'), 2)
+            self.assertEqual(one.count(b'xmlns'), 2)
+            # Each extra URL only costs its own markup, without the declarations a standalone element carries
+            standalone = etree.tostring(etree.fromstring(two)[0], encoding='UTF-8')
+            start = standalone[:standalone.index(b'>') + 1]
+            self.assertTrue(b'xmlns' in start)
+            self.assertEqual(len(two) - len(one), len(standalone) - len(start) + len(b'<url>'))
+
+
 class InvalidSitemapTestCase(SitemapTestCase):
     url = '/sitemap-invalid-simple.xml'
     conf = {'DEBUG': True, 'PRETTY': False}
@@ -389,6 +842,105 @@ class InvalidSitemapTestCase(SitemapTestCase):
                 raise
 
 
+class ValidationModeTestCase(TestCase):
+    urls = 'sitemapext.tests'
+
+    def setUp(self):
+        for i in range(3):
+            Model.objects.create(name='invalid-%s' % i, pub_date='2010-01-01 12:00:00',
+                                 update_date='2013-01-01 12:00:00')
+
+    def render(self, mode, func=None):
+        from logging import Handler
+        from .metrics import get_metrics, reset
+        from .utils import logger
+
+        records = []
+        handler = Handler()
+        handler.emit = records.append
+        logger.addHandler(handler)
+        reset()
+        try:
+            with patch_settings(SITEMAPS_CONFIG={'DEBUG': False, 'VALIDATION': mode}):
+                if func is None:
+                    self.assertEqual(self.client.get('/sitemap-invalid-simple.xml').status_code, 200)
+                else:
+                    func()
+        finally:
+            logger.removeHandler(handler)
+        return [record.getMessage() for record in records], get_metrics().get('validation_errors')
+
+    def test_log(self):
+        records, errors = self.render('log')
+        self.assertEqual(len(records), 3)
+        self.assertEqual(errors, 3)
+
+    def test_summary(self):
+        records, errors = self.render('summary')
+        self.assertEqual(len(records), 1)
+        self.assertTrue(records[0].startswith('/sitemap-invalid-simple.xml: 3 invalid values'))
+        self.assertEqual(errors, 3)
+
+    def test_trusted(self):
+        self.assertEqual(self.render('trusted'), ([], None))
+
+    def test_outside_report(self):
+        from .builder.news import NewsFormatter
+
+        records, errors = self.render('summary', lambda: NewsFormatter.access('free like beer'))
+        self.assertEqual(records, ['Access level free like beer invalid, must be one of subscription,registration'])
+
+    def test_window(self):
+        Model.objects.update(pub_date=datetime.now())
+        records, errors = self.render('summary', lambda: self.client.get('/invalid-news-window.xml'))
+        self.assertEqual(len(records), 1)
+        self.assertEqual(errors, 3)
+
+
+class WindowNewsSitemapTest(TestCase):
+    urls = 'sitemapext.tests'
+
+    def setUp(self):
+        from . import windows
+        windows._windows.clear()
+
+    def create(self, name, age):
+        return Model.objects.create(name=name, pub_date=datetime.now() - timedelta(seconds=age),
+                                    update_date='2013-01-01 12:00:00')
+
+    def test_window(self):
+        self.create('old', 72 * 60 * 60)
+        self.create('first', 60 * 60)
+        response = self.client.get('/news-window.xml')
+        self.assertContains(response, '<news:title>first</news:title>', 1)
+        self.assertNotContains(response, 'old')
+        Model.objects.filter(name='first').update(name='edited')
+        self.create('second', 0)
+        response = self.client.get('/news-window.xml')
+        # Only the new object is queried and rendered, the window keeps the others and their markup
+        self.assertContains(response, '<news:title>first</news:title>', 1)
+        self.assertContains(response, '<news:title>second</news:title>', 1)
+        self.assertTrue(response.content.index(b'second') < response.content.index(b'first'))
+        WindowNewsSitemapView.window = 30 * 60
+        try:
+            response = self.client.get('/news-window.xml')
+        finally:
+            WindowNewsSitemapView.window = NewsSitemapView.window
+        self.assertNotContains(response, 'first')
+        self.assertContains(response, '<news:title>second</news:title>', 1)
+        self.assertEqual(self.client.get('/news-window.xml?page=2').status_code, 404)
+
+    def test_max_size(self):
+        for i in range(5):
+            self.create('news%s' % i, i * 60)
+        size = len(self.client.get('/news-window.xml').content) // 5 * 3
+        # The window is rendered by the builder, which stops at MAX_SIZE like on any other page
+        with patch_settings(SITEMAPS_CONFIG={'MAX_SIZE': size, 'DEBUG': False}):
+            response = self.client.get('/news-window.xml')
+        self.assertContains(response, '<url>', 3)
+        self.assertContains(response, '</urlset>', 1)
+
+
 class InvalidNewsSitemapTestCase(InvalidSitemapTestCase):
     url = '/sitemap-invalid-news.xml'
 
@@ -406,6 +958,450 @@ class LimitedResponseSitemapTestCase(InvalidSitemapTestCase):
     conf = {'MAX_SIZE': 0, 'DEBUG': True, 'PRETTY': False}
 
 
+class RebuildTestCase(SitemapTestCase):
+    num = 10
+    conf = {'STORAGE': 'sitemapext.storage.DatabaseStorage'}
+    url = '/sitemap-simple.xml?page=2'
+    contains = SitemapTestCase.contains + [
+        ('<loc>http://example.com/models/section/page.php&amp;q=name</loc>', 5)
+    ]
+
+    def get_rebuilder(self):
+        return Rebuilder(rebuild_sitemaps, 'sitemap-generator', 'sitemap-index', runner=SyncRunner())
+
+    def test_sitemap(self):
+        with patch_settings(SITEMAPS_CONFIG=self.conf):
+            self.get_rebuilder().rebuild_all()
+            Model.objects.all().delete()
+            return super(RebuildTestCase, self).test_sitemap()
+
+    def test_stored(self):
+        with patch_settings(SITEMAPS_CONFIG=self.conf):
+            self.get_rebuilder().rebuild_all()
+        self.assertEqual(sorted(StoredSitemap.objects.values_list('key', flat=True)),
+                         ['http://example.com/news:1', 'http://example.com/simple:1', 'http://example.com/simple:2',
+                          'http://example.com/sitemap-index.xml'])
+
+    def test_schedule(self):
+        with patch_settings(SITEMAPS_CONFIG=self.conf):
+            scheduler = Scheduler(self.get_rebuilder())
+            self.assertEqual(sorted(scheduler.run_pending()), ['news', 'simple'])
+            StoredSitemap.objects.all().delete()
+            self.assertEqual(scheduler.run_pending(), ['news'])
+        self.assertEqual(sorted(StoredSitemap.objects.values_list('key', flat=True)),
+                         ['http://example.com/news:1', 'http://example.com/sitemap-index.xml'])
+
+    def purge(self, conf):
+        from .storage import get_storage
+
+        stale = ['simple:1', '/sitemap-index.xml', 'http://example.com/simple:3']
+        kept = ['http://example.com/simple:1', 'http://example.com/simple:2', 'http://example.com/news:1',
+                'http://example.com/sitemap-index.xml', 'http://other.com/simple:3']
+        with patch_settings(SITEMAPS_CONFIG=conf):
+            rebuilder = self.get_rebuilder()
+            rebuilder.rebuild_all()
+            storage = get_storage()
+            for key in stale + ['http://other.com/simple:3']:
+                storage.save(key, b'<urlset></urlset>')
+            self.assertEqual(rebuilder.purge(), 3)
+            self.assertEqual(rebuilder.purge(), 0)
+        self.assertEqual(storage.get_many_meta(stale), [None] * 3)
+        self.assertFalse(None in storage.get_many_meta(kept))
+        return storage
+
+    def test_purge(self):
+        self.purge(self.conf)
+        self.assertEqual(StoredSitemap.objects.count(), 5)
+
+    def test_purge_files(self):
+        root = mkdtemp()
+        try:
+            self.purge({'STORAGE': 'sitemapext.storage.FileSystemStorage', 'STORAGE_ROOT': root})
+            self.assertEqual(sorted([name for name in os.listdir(root) if name.endswith('.json')]),
+                             ['http.example.com_news-1.json', 'http.example.com_simple-1.json',
+                              'http.example.com_simple-2.json', 'http.example.com_sitemap-index.xml.json',
+                              'http.other.com_simple-3.json'])
+            self.assertEqual(len(os.listdir(root)), 10)
+        finally:
+            shutil.rmtree(root)
+
+
+class PickledJob(object):
+    """
+    A job run from its pickled function and arguments, like a queue worker in another process would.
+    It finishes once it has been polled.
+    """
+    is_failed = False
+
+    def __init__(self, data):
+        self.data = data
+
+    @property
+    def is_finished(self):
+        if self.data is None:
+            return True
+        func, args = pickle.loads(self.data)
+        self.data = None
+        func(*args)
+        return False
+
+
+class PickledQueue(object):
+
+    def enqueue(self, func, *args):
+        return PickledJob(pickle.dumps((func, args)))
+
+
+def get_queue_runner():
+    return QueueRunner(PickledQueue(), 0)
+
+
+queue_runner = get_queue_runner()
+
+
+class RunnerTestCase(SitemapTestCase):
+    num = 10
+    conf = {'STORAGE': 'sitemapext.storage.DatabaseStorage'}
+
+    def test_sitemap(self):
+        with patch_settings(SITEMAPS_CONFIG=self.conf):
+            Rebuilder('sitemapext.tests.rebuild_sitemaps', 'sitemap-generator', 'sitemap-index',
+                      runner=QueueRunner(PickledQueue(), 0)).rebuild_all()
+        self.assertEqual(sorted(StoredSitemap.objects.values_list('key', flat=True)),
+                         ['http://example.com/news:1', 'http://example.com/simple:1', 'http://example.com/simple:2',
+                          'http://example.com/sitemap-index.xml'])
+
+    def test_dedup(self):
+        rebuilder = Rebuilder('sitemapext.tests.rebuild_sitemaps', 'sitemap-generator',
+                              runner=QueueRunner(PickledQueue(), 0), dedup='exact')
+        self.assertRaises(ValueError, rebuilder.rebuild_all)
+        rebuilder = Rebuilder(rebuild_sitemaps, 'sitemap-generator', runner=QueueRunner(PickledQueue(), 0))
+        self.assertRaises(ValueError, rebuilder.rebuild_section, 'simple')
+
+    def test_get_runner(self):
+        from .tasks import get_runner
+
+        self.assertTrue(isinstance(get_runner(), ThreadRunner))
+        with patch_settings(SITEMAPS_CONFIG={'REBUILD_RUNNER': 'sitemapext.tests.get_queue_runner'}):
+            self.assertTrue(isinstance(get_runner(), QueueRunner))
+        with patch_settings(SITEMAPS_CONFIG={'REBUILD_RUNNER': 'sitemapext.tests.queue_runner'}):
+            self.assertTrue(get_runner() is queue_runner)
+
+    def test_schedule(self):
+        with patch_settings(SITEMAPS_CONFIG=dict(self.conf, REBUILD_RUNNER='sitemapext.tests.get_queue_runner')):
+            rebuilder = Rebuilder('sitemapext.tests.rebuild_sitemaps', 'sitemap-generator', 'sitemap-index')
+            self.assertTrue(isinstance(rebuilder.runner, QueueRunner))
+            self.assertEqual(sorted(Scheduler(rebuilder).run_pending()), ['news', 'simple'])
+        self.assertEqual(sorted(StoredSitemap.objects.values_list('key', flat=True)),
+                         ['http://example.com/news:1', 'http://example.com/simple:1', 'http://example.com/simple:2',
+                          'http://example.com/sitemap-index.xml'])
+
+    def test_threads(self):
+        runner = ThreadRunner(2)
+        results = []
+        runner.submit(results.append, 1)
+        threads = list(runner.threads)
+        runner.join()
+        self.assertEqual(results, [1])
+        self.assertEqual(runner.threads, [])
+        self.assertFalse([thread for thread in threads if thread.is_alive()])
+
+
+class DedupRebuildTestCase(TestCase):
+    urls = 'sitemapext.tests'
+    conf = {'STORAGE': 'sitemapext.storage.DatabaseStorage'}
+
+    def setUp(self):
+        for i in range(6):
+            Model.objects.create(name='dedup-%s' % i, pub_date='2010-01-01 12:00:00', update_date='2013-01-01 12:00:00')
+
+    def rebuild(self, dedup):
+        from .metrics import get_metrics, reset
+        reset()
+        with patch_settings(SITEMAPS_CONFIG=self.conf):
+            Rebuilder(OrderedDict([('simple', ModelSitemapView), ('news', NewsRebuildSitemapView)]),
+                      'sitemap-generator', 'sitemap-index', runner=SyncRunner(), dedup=dedup).rebuild_all()
+        counts = dict(StoredSitemap.objects.values_list('key', 'url_count'))
+        self.assertEqual(counts['http://example.com/simple:1'], 5)
+        self.assertEqual(counts['http://example.com/simple:2'], 1)
+        self.assertEqual(counts['http://example.com/news:1'], 0)
+        self.assertEqual(get_metrics()['urls_deduplicated'], 6)
+        self.assertFalse('dedup-' in force_text(StoredSitemap.objects.get(key='http://example.com/news:1').content))
+
+    def test_exact(self):
+        self.rebuild('exact')
+
+    def test_bloom(self):
+        self.rebuild('bloom')
+
+    def test_filters(self):
+        for dedup in (ExactFilter(), BloomFilter(1000)):
+            self.assertTrue(all([dedup.add('http://example.com/%s' % i) for i in range(1000)]))
+            self.assertFalse(dedup.add('http://example.com/10'))
+            self.assertTrue('http://example.com/10' in dedup)
+            self.assertFalse('http://example.com/1000' in dedup)
+            dedup.drop()
+            self.assertEqual(dedup.dropped, 1)
+
+    def test_max_size(self):
+        from django.test.client import RequestFactory
+
+        dedup = ExactFilter()
+        view = ModelSitemapView.as_view(dedup=dedup)
+        size = len(view(RequestFactory().get('/sitemap-simple.xml')).content) // 5 * 3
+        dedup = ExactFilter()
+        view = ModelSitemapView.as_view(dedup=dedup)
+        with patch_settings(SITEMAPS_CONFIG={'MAX_SIZE': size, 'DEBUG': False}):
+            content = force_text(view(RequestFactory().get('/sitemap-simple.xml')).content)
+        # URLs left out at MAX_SIZE are not marked as seen, so another page can still list them
+        urls = ['http://example.com/models/dedup-%s' % i for i in range(5)]
+        self.assertEqual(len([url for url in urls if url in dedup]), 3)
+        self.assertEqual([url for url in urls if url in dedup], [url for url in urls if url in content])
+
+
+class DifferentialRebuildTestCase(TestCase):
+    urls = 'sitemapext.tests'
+    conf = {'STORAGE': 'sitemapext.storage.DatabaseStorage'}
+
+    def setUp(self):
+        for i in range(6):
+            Model.objects.create(name='diff-%s' % i, pub_date='2010-01-01 12:00:00', update_date='2013-01-01 12:00:00')
+
+    def rebuild(self, view_class=ModelSitemapView):
+        from .metrics import get_metrics, reset
+        reset()
+        with patch_settings(SITEMAPS_CONFIG=self.conf):
+            Rebuilder({'simple': view_class}, 'sitemap-generator', 'sitemap-index',
+                      runner=SyncRunner()).rebuild_all()
+        return get_metrics(), dict(StoredSitemap.objects.values_list('key', 'built'))
+
+    def test_unchanged(self):
+        metrics, built = self.rebuild()
+        self.assertEqual(metrics['pages_written'], 3)
+        self.assertTrue(StoredSitemap.objects.get(key='http://example.com/simple:1').fingerprint)
+        metrics, rebuilt = self.rebuild()
+        self.assertEqual(metrics['pages_unchanged'], 3)
+        self.assertFalse('pages_written' in metrics)
+        self.assertEqual(rebuilt, built)
+
+    def test_changed(self):
+        metrics, built = self.rebuild()
+        Model.objects.filter(name='diff-5').update(update_date='2014-01-01 12:00:00')
+        metrics, rebuilt = self.rebuild()
+        self.assertEqual(metrics['pages_unchanged'], 1)
+        self.assertEqual(metrics['pages_written'], 2)
+        self.assertEqual(rebuilt['http://example.com/simple:1'], built['http://example.com/simple:1'])
+        self.assertNotEqual(rebuilt['http://example.com/simple:2'], built['http://example.com/simple:2'])
+        index = StoredSitemap.objects.get(key='http://example.com/sitemap-index.xml').content
+        self.assertTrue('<lastmod>2014-01-01' in index)
+
+    def test_priority(self):
+        self.rebuild()
+        metrics, rebuilt = self.rebuild(PrioritySitemapView)
+        # Fields other than the location and lastmod are part of the fingerprint too, the index is unchanged
+        self.assertEqual(metrics['pages_written'], 2)
+        self.assertEqual(metrics['pages_unchanged'], 1)
+        content = StoredSitemap.objects.get(key='http://example.com/simple:1').content
+        self.assertTrue('<priority>0.5</priority>' in content)
+
+
+class AlternatesSitemapTest(SitemapTestCase):
+    url = '/alternates.xml'
+    num = 3
+    contains = SitemapTestCase.contains + [
+        ('xmlns:xhtml="http://www.w3.org/1999/xhtml"', 1),
+        ('<xhtml:link rel="alternate" hreflang="de" href="http://example.com/de/models/', 3),
+        ('<xhtml:link rel="alternate" hreflang="en" href="http://example.com/models/section/page.php&amp;q=name"/>', 3),
+    ]
+
+    def test_sitemap(self):
+        AlternatesSitemapView.batches = 0
+        with patch_settings(SITEMAPS_CONFIG={'CHUNK_SIZE': 2}):
+            response = super(AlternatesSitemapTest, self).test_sitemap()
+        self.assertEqual(AlternatesSitemapView.batches, 2)
+        self.assertNotContains(self.client.get('/sitemap-simple.xml'), 'xhtml')
+        return response
+
+
+class SingleAlternatesSitemapTest(SitemapTestCase):
+    url = '/single-alternates.xml'
+    contains = SitemapTestCase.contains + [
+        ('<xhtml:link rel="alternate" hreflang="fr" href="http://example.com/fr/models/', 1),
+        ('<xhtml:link rel="alternate" hreflang="es" href="https://es.example.org/models/', 1),
+    ]
+
+    def test_sitemap(self):
+        response = super(SingleAlternatesSitemapTest, self).test_sitemap()
+        self.assertNotContains(response, 'http://example.comhttps')
+        return response
+
+
+class HostAgnosticTestCase(SitemapTestCase):
+    url = '/cached.xml'
+
+    def test_sitemap(self):
+        from django.contrib.sites.models import Site
+        from .utils import get_cache
+
+        get_cache('default').clear()
+        with patch_settings(SITEMAPS_CONFIG={'HOST_AGNOSTIC': True}):
+            response = self.client.get(self.url)
+            self.assertContains(response, '<loc>http://example.com/models/section/page.php&amp;q=name</loc>', 1)
+            Model.objects.update(name='changed')
+            Site.objects.filter(pk=settings.SITE_ID).update(domain='other.example.com')
+            Site.objects.clear_cache()
+            try:
+                response = self.client.get(self.url, **{'wsgi.url_scheme': 'https'})
+            finally:
+                Site.objects.clear_cache()
+        # Served from the cached page rendered for the first host
+        self.assertContains(response, '<loc>https://other.example.com/models/section/page.php&amp;q=name</loc>', 1)
+        self.assertNotContains(response, 'sitemapext.host')
+
+    def test_storage(self):
+        conf = {'HOST_AGNOSTIC': True, 'STORAGE': 'sitemapext.storage.DatabaseStorage'}
+        with patch_settings(SITEMAPS_CONFIG=conf):
+            response = self.client.get('/sitemap-simple.xml', **{'wsgi.url_scheme': 'https'})
+        self.assertContains(response, '<loc>https://example.com/models/section/page.php&amp;q=name</loc>', 1)
+        self.assertEqual(int(response['Content-Length']), len(response.content))
+        self.assertTrue('<loc>{sitemapext.host}/models/' in StoredSitemap.objects.get(key='simple:1').content)
+
+
+class FragmentCacheTestCase(SimpleSitemapTest):
+    url = '/fragments.xml'
+    num = 2
+
+    def test_sitemap(self):
+        get_fragment_cache().clear()
+        response = super(FragmentCacheTestCase, self).test_sitemap()
+        Model.objects.update(name='changed')
+        self.assertEqual(self.client.get(self.url).content, response.content)
+        Model.objects.filter(pk=Model.objects.all()[0].pk).update(update_date='2014-01-01 12:00:00')
+        response = self.client.get(self.url)
+        self.assertContains(response, '<loc>http://example.com/models/changed</loc>', 1)
+        self.assertContains(response, '<loc>http://example.com/models/section/page.php&amp;q=name</loc>', 1)
+        return response
+
+    def test_views(self):
+        get_fragment_cache().clear()
+        self.client.get(self.url)
+        response = self.client.get('/other-fragments.xml')
+        self.assertContains(response, '<loc>http://example.com/others/', 2)
+        self.assertNotContains(response, '/models/')
+
+    def test_lastmod(self):
+        get_fragment_cache().clear()
+        StringLastmodFragmentCacheSitemapView.calls = 0
+        # Lastmods that are not dates are keyed as they are, and read once per object
+        self.assertEqual(self.client.get('/string-lastmod-fragments.xml').status_code, 200)
+        self.assertEqual(StringLastmodFragmentCacheSitemapView.calls, 2)
+        self.assertEqual(self.client.get('/string-lastmod-fragments.xml').status_code, 200)
+        self.assertEqual(StringLastmodFragmentCacheSitemapView.calls, 4)
+
+
+def replica_router(view):
+    return 'replica'
+
+
+class DatabaseRoutingTestCase(TestCase):
+    urls = 'sitemapext.tests'
+
+    def test_using(self):
+        self.assertEqual(ModelSitemapView().get_queryset().db, 'default')
+        self.assertEqual(ModelSitemapView(using='replica').get_queryset().db, 'replica')
+
+    def test_router(self):
+        with patch_settings(SITEMAPS_CONFIG={'DATABASE_ROUTER': 'sitemapext.tests.replica_router'}):
+            self.assertEqual(ModelSitemapView().get_queryset().db, 'replica')
+            self.assertEqual(ModelSitemapView(using='default').get_queryset().db, 'default')
+
+    def test_index(self):
+        index = SitemapIndex(using='replica', kwargs={'sitemaps': sitemaps, 'generator': 'sitemap-generator'})
+        index.request = None
+        for section, view, url, paginator in index.get_sections():
+            self.assertEqual(paginator.object_list.db, 'replica')
+
+
+class RenderLimitTestCase(SimpleSitemapTest):
+    conf = {'MAX_RENDERS': 1, 'RENDER_QUEUE_TIMEOUT': 0}
+
+    def test_sitemap(self):
+        from .metrics import get_metrics, reset
+
+        reset()
+        with patch_settings(SITEMAPS_CONFIG=self.conf):
+            limiter = get_limiter()
+            token = limiter.acquire()
+            response = self.client.get(self.url)
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response['Retry-After'], '120')
+            limiter.release(token)
+            response = super(RenderLimitTestCase, self).test_sitemap()
+        self.assertEqual(get_metrics()['renders_shed'], 1)
+        self.assertEqual(get_metrics()['renders'], 2)
+        return response
+
+    def test_stored(self):
+        conf = dict(self.conf, STORAGE='sitemapext.storage.DatabaseStorage')
+        with patch_settings(SITEMAPS_CONFIG=conf):
+            super(RenderLimitTestCase, self).test_sitemap()
+            limiter = get_limiter()
+            token = limiter.acquire()
+            self.assertEqual(self.client.get(self.url).status_code, 200)
+            limiter.release(token)
+
+    def test_rebuild(self):
+        conf = dict(self.conf, STORAGE='sitemapext.storage.DatabaseStorage')
+        with patch_settings(SITEMAPS_CONFIG=conf):
+            limiter = get_limiter()
+            token = limiter.acquire()
+            Rebuilder({'simple': ModelSitemapView}, 'sitemap-generator', runner=SyncRunner()).rebuild_all()
+            limiter.release(token)
+        self.assertEqual(list(StoredSitemap.objects.values_list('key', flat=True)), ['http://example.com/simple:1'])
+
+
+class SharedRenderLimitTestCase(RenderLimitTestCase):
+    conf = {'MAX_SHARED_RENDERS': 1, 'RENDER_QUEUE_TIMEOUT': 0}
+
+    def test_expired(self):
+        from .utils import get_cache
+
+        with patch_settings(SITEMAPS_CONFIG=self.conf):
+            limiter = get_limiter()
+            expired = limiter.acquire()
+            # The slot times out while the first render is still running
+            get_cache('default').delete(expired[0])
+            token = limiter.acquire()
+            limiter.release(expired)
+            self.assertEqual(get_cache('default').get(token[0]), token[1])
+            limiter.release(token)
+            self.assertEqual(get_cache('default').get(token[0]), None)
+
+
+class ChunkedSitemapTestCase(SimpleSitemapTest):
+    num = 5
+    contains = SimpleSitemapTest.contains + [
+        ('<url>', 5),
+        ('</urlset>', 1),
+    ]
+
+    def test_sitemap(self):
+        with patch_settings(SITEMAPS_CONFIG={'CHUNK_SIZE': 2, 'DEBUG': True}):
+            return super(ChunkedSitemapTestCase, self).test_sitemap()
+
+
+class LimitedChunkSitemapTestCase(ChunkedSitemapTestCase):
+    contains = SimpleSitemapTest.contains + [
+        ('<url>', 3),
+        ('</urlset>', 1),
+    ]
+
+    def test_sitemap(self):
+        size = len(self.client.get(self.url).content) // 5 * 3
+        with patch_settings(SITEMAPS_CONFIG={'CHUNK_SIZE': 2, 'MAX_SIZE': size, 'DEBUG': False}):
+            return SimpleSitemapTest.test_sitemap(self)
+
+
 class LongURLSitemapTestCase(InvalidSitemapTestCase):
     url = '/sitemap-simple.xml'
     name = SitemapTestCase.name * 100
@@ -417,6 +1413,253 @@ class MissingURLSitemapTestCase(SitemapTestCase):
     contains = []
 
 
+class DatabaseStorageTestCase(SimpleSitemapTest):
+    conf = {'STORAGE': 'sitemapext.storage.DatabaseStorage'}
+
+    def test_sitemap(self):
+        with patch_settings(SITEMAPS_CONFIG=self.conf):
+            response = super(DatabaseStorageTestCase, self).test_sitemap()
+            Model.objects.all().delete()
+            stored = super(DatabaseStorageTestCase, self).test_sitemap()
+        self.assertEqual(response.content, stored.content)
+        self.assertTrue(stored['ETag'])
+        self.assertEqual(stored['Last-Modified'], 'Tue, 01 Jan 2013 00:00:00 GMT')
+        return stored
+
+    def test_metadata(self):
+        self.test_sitemap()
+        stored = StoredSitemap.objects.get(key='http://example.com/simple:1')
+        self.assertEqual(stored.url_count, 1)
+        self.assertEqual(stored.size, len(stored.content.encode('utf-8')))
+
+    def test_hosts(self):
+        with patch_settings(SITEMAPS_CONFIG=self.conf):
+            self.client.get(self.url)
+            response = self.client.get(self.url, **{'wsgi.url_scheme': 'https'})
+        self.assertContains(response, '<loc>https://example.com/models/')
+
+    def test_many_meta(self):
+        from .storage import get_storage
+
+        self.test_sitemap()
+        with patch_settings(SITEMAPS_CONFIG=self.conf):
+            pages = get_storage().get_many_meta(['http://example.com/simple:%s' % number
+                                                 for number in range(1, 1200)])
+        self.assertEqual(pages[0].url_count, 1)
+        self.assertEqual(pages[0].content, None)
+        self.assertEqual(pages[1:], [None] * 1198)
+
+
+class HeadStorageTestCase(SimpleSitemapTest):
+    conf = {'STORAGE': 'sitemapext.storage.DatabaseStorage'}
+
+    def test_sitemap(self):
+        with patch_settings(SITEMAPS_CONFIG=self.conf):
+            built = self.client.head(self.url)
+            response = super(HeadStorageTestCase, self).test_sitemap()
+            Model.objects.all().delete()
+            with self.assertNumQueries(1):
+                head = self.client.head(self.url)
+        self.assertEqual(built.status_code, 200)
+        self.assertEqual(head.status_code, 200)
+        self.assertEqual(head.content, b'')
+        self.assertEqual(head['Content-Type'], 'application/xml')
+        self.assertEqual(int(head['Content-Length']), len(response.content))
+        for header in ('ETag', 'Last-Modified', 'Content-Length'):
+            self.assertEqual(head[header], response[header])
+        return response
+
+
+class FileSystemStorageTestCase(DatabaseStorageTestCase):
+
+    def setUp(self):
+        super(FileSystemStorageTestCase, self).setUp()
+        self.root = mkdtemp()
+        self.conf = {'STORAGE': 'sitemapext.storage.FileSystemStorage', 'STORAGE_ROOT': self.root}
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_metadata(self):
+        from .storage import FileSystemStorage
+
+        self.test_sitemap()
+        stored = FileSystemStorage(self.root).get('http://example.com/simple:1')
+        self.assertEqual(stored.url_count, 1)
+        self.assertEqual(stored.size, len(stored.content))
+
+    def test_versions(self):
+        from .storage import FileSystemStorage
+
+        storage = FileSystemStorage(self.root)
+        first = storage.save('simple:1', b'<urlset>1</urlset>')
+        second = storage.save('simple:1', b'<urlset>2</urlset>')
+        self.assertTrue(os.path.exists(first.path))
+        third = storage.save('simple:1', b'<urlset>3</urlset>')
+        self.assertEqual(storage.get('simple:1').content, b'<urlset>3</urlset>')
+        self.assertEqual(sorted(os.listdir(self.root)),
+                         sorted([os.path.basename(second.path), os.path.basename(third.path), 'simple-1.json']))
+        storage.delete('simple:1')
+        self.assertEqual(os.listdir(self.root), [])
+
+    def test_concurrent_saves(self):
+        from threading import Thread
+        from .storage import FileSystemStorage
+
+        storage = FileSystemStorage(self.root)
+        errors = []
+
+        def save(i):
+            try:
+                for j in range(20):
+                    storage.save('simple:1', ('<urlset>%s-%s</urlset>' % (i, j)).encode('utf-8'))
+                    page = storage.get('simple:1')
+                    if page is not None and storage.checksum(page.content) != page.checksum:
+                        errors.append(page)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [Thread(target=save, args=(i,)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertFalse([name for name in os.listdir(self.root) if name.startswith('.tmp')])
+
+
+class SendfileTestCase(TestCase):
+    urls = 'sitemapext.tests'
+
+    def setUp(self):
+        Model.objects.create(name='sendfile', pub_date='2010-01-01 12:00:00', update_date='2013-01-01 12:00:00')
+        self.root = mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def get(self, sendfile):
+        conf = {'STORAGE': 'sitemapext.storage.FileSystemStorage', 'STORAGE_ROOT': self.root,
+                'SENDFILE': sendfile, 'SENDFILE_URL': '/internal/sitemaps/'}
+        with patch_settings(SITEMAPS_CONFIG=conf):
+            return self.client.get('/sitemap-simple.xml'), self.client.get('/sitemap-simple.xml')
+
+    def get_path(self):
+        from .storage import FileSystemStorage
+
+        return FileSystemStorage(self.root).get_meta('http://example.com/simple:1').path
+
+    def test_accel_redirect(self):
+        for response in self.get('x-accel-redirect'):
+            self.assertEqual(response['X-Accel-Redirect'],
+                             '/internal/sitemaps/%s' % os.path.basename(self.get_path()))
+            self.assertEqual(response.content, b'')
+            self.assertTrue(response.has_header('ETag'))
+
+    def test_sendfile(self):
+        for response in self.get('x-sendfile'):
+            self.assertEqual(response['X-Sendfile'], os.path.abspath(self.get_path()))
+            self.assertTrue(os.path.basename(self.get_path()).startswith('http.example.com_simple-1.'))
+
+    def test_file(self):
+        for response in self.get('file'):
+            content = b''.join(response.streaming_content)
+            self.assertTrue(b'<loc>http://example.com/models/sendfile</loc>' in content)
+            self.assertEqual(int(response['Content-Length']), len(content))
+
+
+class CrawlSimulationTestCase(SitemapTestCase):
+    url = '/crawl-index.xml'
+
+    def test_crawl(self):
+        from .simulation import CrawlSimulation, percentile
+        from .metrics import reset
+
+        self.assertEqual(percentile([3, 1, 2, 4], .5), 2)
+        self.assertEqual(percentile(list(range(1, 101)), .99), 99)
+        # Crawled in this thread, since the in-memory test database is not shared with other threads
+        simulation = CrawlSimulation(self.url, host='testserver')
+        results = []
+        reset()
+        simulation.crawl(results)
+        report = simulation.report(results, 1.)
+        # The root index, its 2 child indexes and the 3 sections
+        self.assertEqual(report['requests'], 6)
+        self.assertEqual(report['errors'], 0)
+        self.assertEqual(report['rendered'], 6)
+        self.assertTrue(report['p99'] >= report['p50'] > 0)
+
+
+class SitemapRegistryTestCase(SitemapTestCase):
+    url = '/registry-index.xml'
+    contains = [
+        '<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">',
+        ('<loc>http://example.com/registry-simple.xml</loc>', 1),
+        ('<loc>http://example.com/registry-news.xml</loc>', 1),
+    ]
+
+    def setUp(self):
+        super(SitemapRegistryTestCase, self).setUp()
+        registry.invalidate()
+
+    def test_counts(self):
+        # Warms up the site cache, leaving the count of each section and the lastmods of the simple section
+        self.test_sitemap()
+        registry.invalidate()
+        with self.assertNumQueries(3):
+            self.test_sitemap()
+        with self.assertNumQueries(1):
+            self.test_sitemap()
+        self.assertEqual(registry.get_stats()['simple']['cached_counts'], 1)
+        registry.invalidate('news')
+        with self.assertNumQueries(2):
+            self.test_sitemap()
+
+    def test_generator(self):
+        requests = registry.get_stats()['simple']['requests']
+        self.assertContains(self.client.get('/registry-simple.xml'), '<urlset', 1)
+        self.assertEqual(registry.get_stats()['simple']['requests'], requests + 1)
+        self.assertEqual(self.client.get('/registry-mobile.xml').status_code, 404)
+
+    def test_dictionary(self):
+        self.assertEqual(list(registry), ['simple', 'news'])
+        self.assertEqual(registry['news'], ModelNewsSitemapView)
+        self.assert_(get_registry(registry) is registry)
+        self.assert_(get_registry(sitemaps) is get_registry(sitemaps))
+        self.assertEqual(dict(get_registry(sitemaps)), sitemaps)
+
+
+class StartupTestCase(TestCase):
+
+    def test_warmup(self):
+        from .apps import warmup
+
+        self.assertEqual(warmup(OrderedDict([('simple', ModelSitemapView), ('news', ModelNewsSitemapView),
+                                             ('model', GenericSitemap)])),
+                         [ModelSitemapView, ModelNewsSitemapView, SitemapIndex])
+
+    def test_ready(self):
+        from django.core.signals import request_started
+        from .apps import SitemapExtConfig
+
+        def connected():
+            return [key for key, receiver in request_started.receivers if key[0] == 'sitemapext.warmup']
+
+        with self.assertNumQueries(0):
+            SitemapExtConfig.__new__(SitemapExtConfig).ready()
+        self.assertTrue(connected())
+        self.client.get('/sitemap-simple.xml')
+        self.assertFalse(connected())
+
+    def test_lazy_import(self):
+        import sys
+        from subprocess import check_output
+
+        script = 'import sys, sitemapext; print(int("lxml" in sys.modules)); print(int("django" in sys.modules))'
+        env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        self.assertEqual(check_output([sys.executable, '-c', script], env=env).split(), [b'0', b'0'])
+
+
 if 'django.contrib.sitemaps' in settings.INSTALLED_APPS:
 
     class PerformanceTest(SimpleSitemapTest):
@@ -1,5 +1,12 @@
 import logging
+from hashlib import md5
+from datetime import datetime
+from threading import local
 from socket import getfqdn, gethostbyname, error
+try:
+    from importlib import import_module
+except ImportError:
+    from django.utils.importlib import import_module
 
 from django.http import HttpResponseNotFound, HttpResponseServerError
 try:
@@ -7,6 +14,35 @@ try:
 except ImportError:
     from django.utils.encoding import force_unicode as force_text
 
+try:
+    from collections import OrderedDict
+except ImportError:
+    # Python 2.6
+    from django.utils.datastructures import SortedDict as OrderedDict
+try:
+    from django.utils import timezone
+except ImportError:
+    timezone = None
+try:
+    from django.utils.dateparse import parse_datetime
+except ImportError:
+    def parse_datetime(value):
+        """
+        Parses the isoformat of a naive datetime, on Django versions without django.utils.dateparse
+        """
+        for format in ('%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S'):
+            try:
+                return datetime.strptime(value, format)
+            except ValueError:
+                pass
+try:
+    from django.core.cache import caches
+
+    def get_cache(alias):
+        return caches[alias]
+except ImportError:
+    from django.core.cache import get_cache
+
 from django.contrib.sites.models import Site
 
 from .settings import CONFIG
@@ -15,24 +51,96 @@ try:
     INT_TYPES = (int, long, float)
 except NameError:
     INT_TYPES = (int, float)
+try:
+    STRING_TYPES = (basestring,)
+except NameError:
+    STRING_TYPES = (str,)
 
 logger = logging.getLogger('sitemapext')
+# Stands in for the protocol and domain of URLs in pages rendered for any host
+HOST_PLACEHOLDER = '{sitemapext.host}'
+_validation = local()
+
+
+class ValidationReport(object):
+    """
+    Collects the failed assertions of a render, made current in this thread with a with statement.
+    In 'log' VALIDATION mode each one is logged as it happens, otherwise only a count and a few samples are kept.
+    In DEBUG, an AssertionError is raised instead.
+    """
+    max_samples = 5
+
+    def __init__(self, mode=None, debug=None):
+        conf = CONFIG()
+        self.mode = conf['VALIDATION'] if mode is None else mode
+        self.debug = conf['DEBUG'] if debug is None else debug
+        self.total = 0
+        self.counts = {}
+        self.samples = []
+
+    def __enter__(self):
+        self.previous = getattr(_validation, 'report', None)
+        _validation.report = self
+        return self
+
+    def __exit__(self, *exc_info):
+        _validation.report = self.previous
+
+    def add(self, msg, args):
+        msg = force_text(msg)
+        if self.debug:
+            raise AssertionError(msg % args)
+        self.total += 1
+        self.counts[msg] = self.counts.get(msg, 0) + 1
+        if self.mode == 'log':
+            logger.warning(msg, *args)
+        elif len(self.samples) < self.max_samples:
+            self.samples.append(msg % args)
+
+    def summary(self):
+        counts = ', '.join(['%s x "%s"' % (count, msg) for msg, count in sorted(self.counts.items())])
+        return '%s invalid values (%s), eg: %s' % (self.total, counts, '; '.join(self.samples))
+
+
+def validating():
+    """
+    Returns False if per-value checks are skipped, as in the 'trusted' VALIDATION mode
+    """
+    report = getattr(_validation, 'report', None)
+    return (CONFIG()['VALIDATION'] if report is None else report.mode) != 'trusted'
 
 
 def assert_(stmt, msg, *args):
     """
     Asserts that some statement is True.
     If AssertionError is raised and SITEMAPS_DEBUG is True, error message is raised with arguments.
-    If AssertionError is raised and SITEMAPS_DEBUG is False, error message is logged to 'sitemapext' logger with WARN level.
+    If AssertionError is raised and SITEMAPS_DEBUG is False, the error is added to the current ValidationReport,
+    which logs it to the 'sitemapext' logger with WARN level or keeps it for a summary depending on VALIDATION.
+    Outside of a report there is no summary to keep it for, so it is always logged.
     """
-    msg = force_text(msg)
-    try:
-        assert stmt
-    except AssertionError:
-        if CONFIG()['DEBUG']:
-            raise AssertionError(msg % args)
-        else:
-            logger.warning(msg, *args)
+    if stmt:
+        return
+    report = getattr(_validation, 'report', None)
+    if report is None:
+        report = ValidationReport(mode='log')
+    report.add(msg, args)
+
+
+def import_string(path):
+    """
+    Imports an attribute from a dotted module path (eg 'sitemapext.storage.DatabaseStorage').
+    """
+    module, attr = path.rsplit('.', 1)
+    return getattr(import_module(module), attr)
+
+
+def now():
+    """
+    Returns the current datetime, timezone aware if django.utils.timezone is available.
+    """
+    if timezone:
+        return timezone.now()
+    return datetime.now()
 
 
 def get_current_domain(request):
@@ -45,6 +153,32 @@ def get_current_domain(request):
     return request.get_host()
 
 
+def get_host_prefix(request):
+    """
+    Returns the protocol and domain that URLs start with for the request
+    """
+    return '%s://%s' % ('https' if request.is_secure() else 'http', get_current_domain(request))
+
+
+def localize(response, prefix):
+    """
+    Replaces the host placeholder in a host agnostic response with the prefix, updating its Content-Length and ETag
+    """
+    if response.status_code != 200 or getattr(response, 'streaming', False) or getattr(response, 'localized', False):
+        return response
+    response.localized = True
+    if response.content:
+        response.content = response.content.replace(HOST_PLACEHOLDER.encode('utf-8'), prefix.encode('utf-8'))
+        if response.has_header('Content-Length'):
+            response['Content-Length'] = len(response.content)
+    elif response.has_header('Content-Length'):
+        # The size of a HEAD response can't be known without the content
+        del response['Content-Length']
+    if response.has_header('ETag'):
+        response['ETag'] = '"%s-%s"' % (response['ETag'].strip('"'), md5(prefix.encode('utf-8')).hexdigest()[:8])
+    return response
+
+
 def get_client_ip(request):
     x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
     if x_forwarded_for:
@@ -1,10 +1,26 @@
+import os
+from math import ceil
+from datetime import timedelta
 from random import randint
+from hashlib import md5
+from calendar import timegm
 
 from django.conf import settings
 from django.http import HttpResponse, Http404, HttpResponseForbidden
-from django.core.urlresolvers import reverse
 from django.utils.cache import patch_response_headers
+from django.utils.http import http_date
 from django.views.decorators.cache import cache_page, never_cache
+try:
+    from django.http import FileResponse
+except ImportError:
+    from wsgiref.util import FileWrapper
+    try:
+        from django.http import StreamingHttpResponse
+    except ImportError:
+        StreamingHttpResponse = HttpResponse
+
+    def FileResponse(file, **kwargs):
+        return StreamingHttpResponse(FileWrapper(file), **kwargs)
 try:
     from django.views.generic import ListView, View
 except ImportError:
@@ -14,7 +30,15 @@ except ImportError:
         raise ImportError('You must have either Django>=1.3 or django-cbv>=0.2 installed.')
 
 from .builder import Sitemap, Index, NewsSitemap, VideoSitemap, ImageSitemap, MobileSitemap
-from .utils import get_client_ip, is_googlebot
+from .builder.base import iter_batches
+from .storage import get_storage
+from .fragments import get_fragment_cache
+from .limits import get_limiter, Saturated
+from .windows import get_window
+from .registry import get_registry
+from .settings import CONFIG
+from .utils import get_client_ip, is_googlebot, import_string, now, get_cache, get_host_prefix, localize
+from . import metrics
 
 
 class CacheMixin(object):
@@ -31,17 +55,173 @@ class CacheMixin(object):
     def get_key_prefix(self):
         return self.key_prefix
 
-    def dispatch(self, *args, **kwargs):
+    def dispatch(self, request, *args, **kwargs):
         timeout = self.get_cache_timeout()
-        if timeout is None:
-            return super(CacheMixin, self).dispatch(*args, **kwargs)
         if isinstance(timeout, (list, tuple)):
             timeout = randint(*timeout)
-        response = cache_page(timeout, cache=self.get_cache(), key_prefix=self.get_key_prefix()
-                              )(super(CacheMixin, self).dispatch)(*args, **kwargs)
-        patch_response_headers(response, timeout)
+        if CONFIG()['HOST_AGNOSTIC']:
+            response = localize(self.agnostic_dispatch(timeout, request, *args, **kwargs), get_host_prefix(request))
+        elif timeout is None:
+            return super(CacheMixin, self).dispatch(request, *args, **kwargs)
+        else:
+            response = cache_page(timeout, cache=self.get_cache(), key_prefix=self.get_key_prefix()
+                                  )(super(CacheMixin, self).dispatch)(request, *args, **kwargs)
+        if response.status_code == 200 and timeout is not None:
+            patch_response_headers(response, timeout)
+        return response
+
+    def agnostic_dispatch(self, timeout, request, *args, **kwargs):
+        """
+        Returns the host agnostic response, cached under the same key for every host
+        """
+        if timeout is None or request.method not in ('GET', 'HEAD'):
+            return super(CacheMixin, self).dispatch(request, *args, **kwargs)
+        cache = get_cache(self.get_cache() or 'default')
+        key = 'sitemapext.page.%s.%s.%s' % (self.get_key_prefix() or '', request.method,
+                                            md5(request.get_full_path().encode('utf-8')).hexdigest())
+        response = cache.get(key)
+        if response is None:
+            response = super(CacheMixin, self).dispatch(request, *args, **kwargs)
+            if response.status_code == 200 and not getattr(response, 'streaming', False):
+                cache.set(key, response, timeout)
+        return response
+
+
+class StorageMixin(object):
+    """
+    Serves pages from the configured storage backend, rendering and storing them on a miss
+    """
+    storage = None
+    building = False
+
+    def get_storage(self):
+        if self.storage is None:
+            return get_storage()
+        return self.storage
+
+    def get_storage_prefix(self):
+        """
+        Returns the protocol and domain of the request, which the rendered URLs and so the storage keys depend on,
+        or an empty string for host agnostic pages, which are stored once for all hosts
+        """
+        if CONFIG()['HOST_AGNOSTIC']:
+            return ''
+        return get_host_prefix(self.request)
+
+    def prefix_storage_key(self, key):
+        prefix = self.get_storage_prefix()
+        return '%s/%s' % (prefix, key.lstrip('/')) if prefix else key
+
+    def get_storage_key(self, page=None):
+        if page is None:
+            page = self.kwargs.get('page') or self.request.GET.get('page') or 1
+        return self.prefix_storage_key('%s:%s' % (self.kwargs.get('section', self.request.path), page))
+
+    def get_sendfile(self, page=None):
+        """
+        Returns the SENDFILE mode used to serve stored files, or None if they are served from Python.
+        Host agnostic pages and pages without a file are never sent directly.
+        """
+        conf = CONFIG()
+        if conf['HOST_AGNOSTIC'] or self.request.method != 'GET' or (page is not None and not page.path):
+            return None
+        return conf['SENDFILE']
+
+    def sendfile_response(self, page, sendfile):
+        """
+        Returns a response that leaves sending the page's file to the front-end server
+        """
+        if sendfile == 'file':
+            response = FileResponse(open(page.path, 'rb'), content_type='application/xml')
+            response['Content-Length'] = page.size
+            return response
+        response = HttpResponse(content_type='application/xml')
+        if sendfile == 'x-accel-redirect':
+            path = os.path.relpath(page.path, self.get_storage().root).replace(os.sep, '/')
+            response['X-Accel-Redirect'] = '%s/%s' % (CONFIG()['SENDFILE_URL'].rstrip('/'), path)
+        elif sendfile == 'x-sendfile':
+            response['X-Sendfile'] = os.path.abspath(page.path)
+        else:
+            raise ValueError('Unknown SENDFILE mode "%s"' % sendfile)
         return response
 
+    def stored_response(self, page):
+        sendfile = self.get_sendfile(page)
+        if sendfile:
+            response = self.sendfile_response(page, sendfile)
+        else:
+            response = HttpResponse(page.content or b'', content_type='application/xml')
+            response['Content-Length'] = page.size
+        lastmod = page.lastmod or page.built
+        if lastmod:
+            response['Last-Modified'] = http_date(timegm(lastmod.utctimetuple()))
+        response['ETag'] = '"%s"' % page.checksum
+        return response
+
+    def dispatch(self, request, *args, **kwargs):
+        storage = self.get_storage()
+        if storage is None or request.method.lower() not in self.http_method_names:
+            return super(StorageMixin, self).dispatch(request, *args, **kwargs)
+        key = self.get_storage_key()
+        if request.method == 'HEAD' or self.get_sendfile():
+            page = storage.get_meta(key)
+            if page is not None and request.method != 'HEAD' and not self.get_sendfile(page):
+                page = storage.get(key)
+        else:
+            page = storage.get(key)
+        if page is None:
+            return self.build(request, *args, **kwargs)
+        return self.stored_response(page)
+
+    def build(self, request, *args, **kwargs):
+        """
+        Renders the page and saves it to the storage, replacing any stored version.
+        Pages that render to the same content and fingerprint as the stored version are not written again,
+        so their stored lastmod and build time are kept.
+        """
+        storage = self.get_storage()
+        key = self.get_storage_key()
+        self.building = True
+        response = super(StorageMixin, self).dispatch(request, *args, **kwargs)
+        builder = getattr(self, 'builder', None)
+        if response.status_code != 200 or builder is None:
+            return response
+        fingerprint = builder.digest and builder.digest.hexdigest()
+        page = storage.get_meta(key)
+        if page is not None and page.checksum == storage.checksum(response.content) and \
+                page.fingerprint == fingerprint:
+            metrics.incr('pages_unchanged')
+            page.content = response.content
+            return self.stored_response(page)
+        metrics.incr('pages_written')
+        return self.stored_response(storage.save(key, response.content, builder.lastmod, builder.count, fingerprint))
+
+
+class RenderLimitMixin(object):
+    """
+    Limits the number of renders running at the same time, as configured by MAX_RENDERS and MAX_SHARED_RENDERS.
+    Requests that wait longer than RENDER_QUEUE_TIMEOUT for their turn get a 503 response.
+    Pages served from the cache or storage are not limited, and neither are renders with limit_renders off,
+    as for rebuilds.
+    """
+    limit_renders = True
+
+    def dispatch(self, request, *args, **kwargs):
+        limiter = get_limiter()
+        if limiter is None or not self.limit_renders:
+            return super(RenderLimitMixin, self).dispatch(request, *args, **kwargs)
+        try:
+            token = limiter.acquire()
+        except Saturated:
+            response = HttpResponse('Too many sitemaps are being rendered, try again later', status=503,
+                                    content_type='text/plain')
+            response['Retry-After'] = CONFIG()['RETRY_AFTER']
+            return response
+        try:
+            return super(RenderLimitMixin, self).dispatch(request, *args, **kwargs)
+        finally:
+            limiter.release(token)
+
 
 class GoogleBotVerifierMixin(object):
     override_password = 'changeme'
@@ -53,24 +233,172 @@ class GoogleBotVerifierMixin(object):
         return HttpResponseForbidden()
 
 
-class SitemapView(CacheMixin, ListView):
-    http_method_names = ['get']
+class SitemapView(CacheMixin, StorageMixin, RenderLimitMixin, ListView):
+    http_method_names = ['get', 'head']
     builder_class = Sitemap
     paginate_by = 50000
+    lastmod_field = None
+    rebuild_interval = None
+    fragment_cache = False
+    using = None
+    dedup = None
 
     def get(self, request, *args, **kwargs):
         super(SitemapView, self).get(request, *args, **kwargs)
         context = self.get_context_data(object_list=self.object_list)
-        self.builder = self.builder_class(self, context['object_list'])
+        self.builder = self.builder_class(self, self.get_entries(self.stream(context['object_list'])))
+        if self.building:
+            self.builder.digest = md5()
         return HttpResponse(self.builder.render(), content_type='application/xml')
 
     def location(self, obj):
         return obj.get_absolute_url()
 
+    def stream(self, object_list):
+        """
+        Yields the objects of the page one by one, read in batches of CHUNK_SIZE objects so that querysets
+        are not cached, with their prefetch_related lookups prefetched for each batch
+        """
+        for batch in iter_batches(object_list, CONFIG()['CHUNK_SIZE']):
+            for obj in batch:
+                yield obj
+
+    def get_entries(self, object_list):
+        """
+        Returns the objects of the page to render, which are the objects of the page streamed by default.
+        Override to yield SitemapEntry instances, eg built from values_list rows,
+        so the builder does not need model instances or the view's accessors.
+        """
+        return object_list
+
+    def get_using(self):
+        """
+        Returns the alias of the database to run the sitemap queries on.
+        Defaults to the view's using attribute, then to the DATABASE_ROUTER function, which is called with the view.
+        """
+        if self.using is not None:
+            return self.using
+        router = CONFIG()['DATABASE_ROUTER']
+        if router:
+            return import_string(router)(self)
+
+    def get_queryset(self):
+        queryset = super(SitemapView, self).get_queryset()
+        using = self.get_using()
+        if using is not None and hasattr(queryset, 'using'):
+            queryset = queryset.using(using)
+        return queryset
+
+    def get_fragment_cache(self):
+        """
+        Returns the cache of rendered URL elements, or None to render every object.
+        Set fragment_cache to True to use the cache shared by all sitemap views.
+        """
+        if self.fragment_cache is True:
+            return get_fragment_cache()
+        return self.fragment_cache or None
+
+    def get_page_lastmods(self, paginator, page_range=None):
+        """
+        Returns the most recent lastmod of each page in the page_range (defaults to all pages).
+        The lastmods of stored pages are read from their metadata, without their content.
+        The lastmods of the other pages are computed from a single query per section, see get_range_lastmods.
+        """
+        if page_range is None:
+            page_range = paginator.page_range
+        storage = self.get_storage()
+        if storage is not None:
+            pages = storage.get_many_meta([self.get_storage_key(number) for number in page_range])
+        else:
+            pages = [None] * len(page_range)
+        lastmods = [page and page.lastmod for page in pages]
+        missing = [number for number, page in zip(page_range, pages) if page is None]
+        if self.lastmod_field is None or not missing or not paginator.count or \
+                not hasattr(paginator.object_list, 'values_list'):
+            return lastmods
+        maxima = self.get_range_lastmods(paginator, missing[0], missing[-1])
+        for i, number in enumerate(page_range):
+            if pages[i] is None:
+                lastmods[i] = maxima.get(number)
+        return lastmods
+
+    def get_range_lastmods(self, paginator, first, last):
+        """
+        Returns a dictionary of the most recent lastmod_field value of each page from first to last.
+        The lastmod_field column of those pages is streamed in one query, in the order of the pages,
+        and each value is bucketed into its page by its position.
+        """
+        per_page = paginator.per_page
+        start = (first - 1) * per_page
+        # The last page also holds the orphans
+        if last < paginator.num_pages:
+            queryset = paginator.object_list[start:last * per_page]
+        else:
+            queryset = paginator.object_list[start:]
+        lastmods = {}
+        for position, value in enumerate(queryset.values_list(self.lastmod_field, flat=True).iterator(), start):
+            number = min(position // per_page + 1, paginator.num_pages)
+            if value is not None and (lastmods.get(number) is None or value > lastmods[number]):
+                lastmods[number] = value
+        return lastmods
+
 
 class NewsSitemapView(SitemapView):
+    """
+    Set window_field to the name of the publication date field to only list the objects published in the last
+    window seconds, as Google News expects. The window is then kept in memory and updated incrementally:
+    each request only queries and renders the objects published since the previous one and drops the expired ones.
+    Objects are re-read in full every window_refresh seconds, so edits and removals show up.
+    Windowed sitemaps are always served live, never from storage.
+    """
     paginate_by = 1000
     builder_class = NewsSitemap
+    window_field = None
+    window = 48 * 60 * 60
+    window_refresh = 10 * 60
+
+    def get_storage(self):
+        if self.window_field is not None:
+            return None
+        return super(NewsSitemapView, self).get_storage()
+
+    def get_queryset(self):
+        queryset = super(NewsSitemapView, self).get_queryset()
+        if self.window_field is None:
+            return queryset
+        # A range on the publication date in index order, newest first
+        return queryset.filter(**{'%s__gte' % self.window_field: now() - timedelta(seconds=self.window)}
+                               ).order_by('-%s' % self.window_field, '-pk')
+
+    def get_window_key(self):
+        return '%s.%s' % (self.__class__.__module__, self.__class__.__name__)
+
+    def get_fragment_cache(self):
+        """
+        Windowed sitemaps keep the markup of their objects in the window, unless they have a fragment cache
+        """
+        fragments = super(NewsSitemapView, self).get_fragment_cache()
+        if fragments is None and self.window_field is not None:
+            return get_window(self.get_window_key()).fragments
+        return fragments
+
+    def get(self, request, *args, **kwargs):
+        if self.window_field is None:
+            return super(NewsSitemapView, self).get(request, *args, **kwargs)
+        page = self.kwargs.get('page') or request.GET.get('page') or 1
+        try:
+            page = int(page)
+        except ValueError:
+            raise Http404('Invalid page: %r' % page)
+        if page < 1:
+            raise Http404('Invalid page: %r' % page)
+        objects = get_window(self.get_window_key()).get_objects(self, (page - 1) * self.paginate_by,
+                                                                page * self.paginate_by)
+        self.builder = self.builder_class(self, self.get_entries(objects))
+        content = self.builder.render()
+        if page > 1 and not self.builder.count:
+            raise Http404('Invalid page: %r' % page)
+        return HttpResponse(content, content_type='application/xml')
 
 
 class VideoSitemapView(SitemapView):
@@ -85,27 +413,82 @@ class MobileSitemapView(SitemapView):
     builder_class = MobileSitemap
 
 
-class SitemapIndex(CacheMixin, View):
-    http_method_names = ['get']
+class SitemapIndex(CacheMixin, StorageMixin, RenderLimitMixin, View):
+    """
+    Lists every page of every section in the sitemaps.
+    When there are more than paginate_by pages, the index lists paginated child indexes instead,
+    each of which only computes the lastmods of the pages it contains.
+    Every section is still counted to find where its pages fall, a SitemapRegistry can cache the counts.
+    """
+    http_method_names = ['get', 'head']
     builder_class = Index
+    paginate_by = 50000
+    using = None
+
+    def get_sections(self):
+        """
+        Yields the section name, view instance, base url and paginator of each section
+        """
+        registry = get_registry(self.kwargs['sitemaps'])
+        for section, view in registry.items():
+            view = view(request=self.request, args=(), kwargs={'section': section})
+            if self.using is not None:
+                view.using = self.using
+            url = registry.get_url(self.kwargs['generator'], section)
+            yield section, view, url, registry.get_paginator(section, view)
+
+    def generate(self, sections, start, end):
+        """
+        Yields the url and lastmod of the pages with an overall position between start and end
+        """
+        offset = 0
+        for section, view, url, paginator in sections:
+            num_pages = paginator.num_pages
+            if offset + num_pages > start:
+                first = max(start - offset, 0) + 1
+                last = min(end - offset, num_pages)
+                page_range = range(first, last + 1)
+                for page, lastmod in zip(page_range, view.get_page_lastmods(paginator, page_range)):
+                    yield url if page == 1 else '%s?page=%s' % (url, page), lastmod
+            offset += num_pages
+            if offset >= end:
+                break
+
+    def get_storage_key(self, page=None):
+        page = page or self.request.GET.get('page')
+        if page is None:
+            return self.prefix_storage_key(self.request.path)
+        return self.prefix_storage_key('%s:%s' % (self.request.path, page))
+
+    def get_num_indexes(self, sections):
+        total = sum([paginator.num_pages for section, view, url, paginator in sections])
+        return max(int(ceil(total / float(self.paginate_by))), 1)
 
     def get(self, request, *args, **kwargs):
-        def generate():
-            for section, view in kwargs['sitemaps'].items():
-                view = view()
-                url = reverse(kwargs['generator'], kwargs={'section': section})
-                yield url
-                paginator = view.get_paginator(view.get_queryset(), view.paginate_by)
-                for page in range(2, paginator.num_pages + 1):
-                    yield '%s?page=%s' % (url, page)
-        self.builder = self.builder_class(self, generate())
+        sections = list(self.get_sections())
+        num_indexes = self.get_num_indexes(sections)
+        page = request.GET.get('page')
+        if page is None and num_indexes > 1:
+            entries = ['%s?page=%s' % (request.path, number) for number in range(1, num_indexes + 1)]
+        else:
+            try:
+                page = int(page or 1)
+            except ValueError:
+                raise Http404('Invalid sitemap index page: %r' % page)
+            if not 1 <= page <= num_indexes:
+                raise Http404('No sitemap index page: %r' % page)
+            start = (page - 1) * self.paginate_by
+            entries = self.generate(sections, start, start + self.paginate_by)
+        self.builder = self.builder_class(self, entries)
         return HttpResponse(self.builder.render(), content_type='application/xml')
 
 
 class SitemapGenerator(CacheMixin, View):
-    http_method_names = ['get']
+    http_method_names = ['get', 'head']
 
     def dispatch(self, request, *args, **kwargs):
-        if not kwargs['section'] in kwargs['sitemaps']:
+        try:
+            view = get_registry(kwargs['sitemaps']).get_view(kwargs['section'])
+        except KeyError:
             raise Http404("No sitemap available for section: %r" % kwargs['section'])
-        return kwargs['sitemaps'][kwargs['section']].as_view()(request, *args, **kwargs)
+        return view(request, *args, **kwargs)
@@ -0,0 +1,72 @@
+from time import time
+from datetime import timedelta
+from threading import Lock
+
+from .fragments import LRUCache
+from .utils import now
+
+
+class RollingWindow(object):
+    """
+    Keeps the objects published within a view's window, newest first, along with the rendered markup of their URLs.
+    Each update only queries the objects published since the last one and evicts the expired ones.
+    The whole window is queried again every window_refresh seconds to pick up edits and removals,
+    or never if window_refresh is None.
+    Pages of the window are rendered by the view's builder like any other page, with fragments as their fragment
+    cache unless the view has one of its own, so only the objects new to the window are rendered.
+    """
+
+    def __init__(self):
+        self.objects = []
+        self.refreshed = None
+        self.fragments = LRUCache(0)
+        self.lock = Lock()
+
+    def fetch(self, view):
+        """
+        Returns the objects published since the newest object in the window, or the whole window when it is due
+        for a refresh
+        """
+        queryset = view.get_queryset()
+        refresh = view.window_refresh
+        if self.refreshed is None or (refresh is not None and time() - self.refreshed >= refresh):
+            self.objects = []
+            self.fragments.clear()
+            self.refreshed = time()
+            return queryset
+        if not self.objects:
+            return queryset
+        newest = self.objects[0][0]
+        seen = set([pk for published, pk, obj in self.objects if published == newest])
+        new = queryset.filter(**{'%s__gte' % view.window_field: newest})
+        return [obj for obj in new if obj.pk not in seen]
+
+    def update(self, view):
+        self.objects[:0] = [(getattr(obj, view.window_field), obj.pk, obj) for obj in self.fetch(view)]
+        cutoff = now() - timedelta(seconds=view.window)
+        while self.objects and self.objects[-1][0] < cutoff:
+            self.objects.pop()
+        # Room for the markup of every object in the window, the expired ones are the least recently used
+        self.fragments.size = 2 * len(self.objects)
+
+    def get_objects(self, view, start=0, stop=None):
+        """
+        Updates the window and returns its objects between start and stop
+        """
+        with self.lock:
+            self.update(view)
+            return [obj for published, pk, obj in self.objects[start:stop]]
+
+
+_windows = {}
+_windows_lock = Lock()
+
+
+def get_window(key):
+    """
+    Returns the rolling window for the key, shared by all requests in this process
+    """
+    with _windows_lock:
+        if key not in _windows:
+            _windows[key] = RollingWindow()
+        return _windows[key]